@@ -5,48 +5,163 @@ This version handles cookie consent and fixes progress updates
 """
 
 import os
+import hashlib
+import sqlite3
+import sys
 import uuid
-import zipfile
 import threading
 import time
-import queue
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, send_from_directory, abort, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from flask_sqlalchemy import SQLAlchemy
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from sqlalchemy import and_, event, func, inspect, or_, text
+from sqlalchemy.engine import Engine
 import json
+import metrics
+from result_archive import iter_archive_entries, stream_zip
+
+# Selenium, pandas, Pillow and Celery are only imported by the capture
+# worker (worker.py); web processes load ingest lazily to check uploads
 
 # Flask app setup
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+# Larger uploads are rejected while they stream in (413)
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_UPLOAD_MB', 100)) * 1024 * 1024)
+app.config['UPLOAD_DIR'] = os.environ.get('UPLOAD_DIR', 'uploads')
 
 # Use absolute path for database
 db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'routes.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+database_url = os.environ.get('DATABASE_URL', f'sqlite:///{db_path}')
+if database_url.startswith('postgres://'):
+    # Heroku still hands out postgres:// URLs, which SQLAlchemy no longer accepts
+    database_url = 'postgresql://' + database_url[len('postgres://'):]
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['SQLITE_BUSY_TIMEOUT'] = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))
+if not database_url.startswith('sqlite'):
+    # Web requests, job workers, their lease heartbeats and progress flushes
+    # each hold a connection briefly; pre-ping drops ones the server closed
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+# Capture settings
+app.config['MAPS_BASE_URL'] = os.environ.get('MAPS_BASE_URL', 'https://www.google.com/maps').rstrip('/')
+app.config['CAPTURE_DRIVERS'] = int(os.environ.get('CAPTURE_DRIVERS', os.cpu_count() or 1))
+app.config['MAX_CAPTURE_DRIVERS'] = int(os.environ.get('MAX_CAPTURE_DRIVERS', 4))
+app.config['DRIVER_RESTART_LIMIT'] = int(os.environ.get('DRIVER_RESTART_LIMIT', 3))
+app.config['SETTLE_TIMEOUT'] = float(os.environ.get('SETTLE_TIMEOUT', 20))
+app.config['NETWORK_IDLE_WINDOW'] = float(os.environ.get('NETWORK_IDLE_WINDOW', 0.5))
+# reload or inpage; inpage is experimental until proven against the live Maps site
+app.config['NAVIGATION_MODE'] = os.environ.get('NAVIGATION_MODE', 'reload').lower()
+app.config['INPAGE_SETTLE_TIMEOUT'] = float(os.environ.get('INPAGE_SETTLE_TIMEOUT', 5))
+app.config['ROUTE_ORDER'] = os.environ.get('ROUTE_ORDER', 'locality').lower()  # locality or sheet
+app.config['ROUTE_ORDER_WINDOW'] = int(os.environ.get('ROUTE_ORDER_WINDOW', 2000))
+app.config['CHROME_PROFILE_DIR'] = os.environ.get('CHROME_PROFILE_DIR', 'chrome_profile')
+app.config['WARM_DRIVERS'] = int(os.environ.get('WARM_DRIVERS', app.config['MAX_CAPTURE_DRIVERS']))
+app.config['DRIVER_IDLE_TIMEOUT'] = float(os.environ.get('DRIVER_IDLE_TIMEOUT', 600))
+app.config['DRIVER_MAX_ROUTES'] = int(os.environ.get('DRIVER_MAX_ROUTES', 500))
+app.config['DRIVER_MAX_RSS_MB'] = int(os.environ.get('DRIVER_MAX_RSS_MB', 1536))
+app.config['DRIVER_SLOWDOWN_FACTOR'] = float(os.environ.get('DRIVER_SLOWDOWN_FACTOR', 3))
+app.config['DRIVER_MEMORY_CHECK_EVERY'] = int(os.environ.get('DRIVER_MEMORY_CHECK_EVERY', 10))
+app.config['INGEST_CHUNK_SIZE'] = int(os.environ.get('INGEST_CHUNK_SIZE', 500))
+app.config['SCREENSHOT_CACHE_DIR'] = os.environ.get('SCREENSHOT_CACHE_DIR', 'screenshot_cache')
+app.config['SCREENSHOT_CACHE_MAX_MB'] = int(os.environ.get('SCREENSHOT_CACHE_MAX_MB', 2048))
+app.config['SCREENSHOT_CACHE_TTL_HOURS'] = float(os.environ.get('SCREENSHOT_CACHE_TTL_HOURS', 336))
+app.config['PROGRESS_FLUSH_INTERVAL'] = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 2))
+app.config['PROGRESS_FLUSH_EVERY'] = int(os.environ.get('PROGRESS_FLUSH_EVERY', 25))
+app.config['EVENTS_POLL_INTERVAL'] = float(os.environ.get('EVENTS_POLL_INTERVAL', 1))
+# Each stream holds a web thread, so it stays short of gunicorn's 30 second timeout
+app.config['EVENTS_MAX_SECONDS'] = float(os.environ.get('EVENTS_MAX_SECONDS', 20))
+
+# Screenshot capture and post-processing
+app.config['CAPTURE_MODE'] = os.environ.get('CAPTURE_MODE', 'devtools').lower()  # devtools or webdriver
+app.config['CAPTURE_FORMAT'] = os.environ.get('CAPTURE_FORMAT', 'png').lower()
+app.config['CAPTURE_QUALITY'] = int(os.environ.get('CAPTURE_QUALITY', 80))
+app.config['CAPTURE_CROP'] = os.environ.get('CAPTURE_CROP', '432,0,1920,1080')
+app.config['THUMBNAIL_WIDTH'] = int(os.environ.get('THUMBNAIL_WIDTH', 320))
+app.config['THUMBNAIL_DIR'] = os.environ.get('THUMBNAIL_DIR', 'thumbnails')
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 1))
+
+# Capture quality checks
+app.config['QUALITY_CHECKS'] = os.environ.get('QUALITY_CHECKS', 'blank,grey,consent')
+app.config['QUALITY_GREY_SHARE'] = float(os.environ.get('QUALITY_GREY_SHARE', 0.99))
+app.config['QUALITY_TEMPLATE_DIR'] = os.environ.get('QUALITY_TEMPLATE_DIR', 'quality_templates')
+app.config['QUALITY_RETRIES'] = int(os.environ.get('QUALITY_RETRIES', 2))
+app.config['QUALITY_RETRY_BACKOFF'] = float(os.environ.get('QUALITY_RETRY_BACKOFF', 5))
+
+# Browser-free tile renderer
+app.config['TILE_DIR'] = os.environ.get('TILE_DIR', 'tiles')
+app.config['TILE_CACHE_TILES'] = int(os.environ.get('TILE_CACHE_TILES', 256))
+app.config['TILE_MAX_ZOOM'] = int(os.environ.get('TILE_MAX_ZOOM', 17))
+
+# Job queue settings
+app.config['WORKER_THREADS'] = int(os.environ.get('WORKER_THREADS', 4))
+app.config['JOB_LEASE_SECONDS'] = float(os.environ.get('JOB_LEASE_SECONDS', 90))
+app.config['QUEUE_POLL_INTERVAL'] = float(os.environ.get('QUEUE_POLL_INTERVAL', 2))
+app.config['WORKER_METRICS_PORT'] = int(os.environ.get('WORKER_METRICS_PORT', 0))  # 0 = not exported
+app.config['MAX_JOB_ATTEMPTS'] = int(os.environ.get('MAX_JOB_ATTEMPTS', 3))
+
+# Fair scheduling: jobs of different users share the Chrome capture slots route by route
+app.config['CAPTURE_SLOTS'] = int(os.environ.get('CAPTURE_SLOTS', app.config['MAX_CAPTURE_DRIVERS']))
+app.config['MAX_USER_JOBS'] = int(os.environ.get('MAX_USER_JOBS', 2))  # jobs of one user running at once
+# Usernames allowed to queue High priority jobs
+app.config['ADMIN_USERS'] = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
+app.config['MAX_USER_ROUTES'] = int(os.environ.get('MAX_USER_ROUTES', 0))  # 0 = no limit
+app.config['ETA_WINDOW_SECONDS'] = float(os.environ.get('ETA_WINDOW_SECONDS', 600))
+
+# Distributed capture: with CAPTURE_BACKEND=celery the worker that claimed a
+# job sends its routes through the broker to capture nodes (celery -A worker.celery worker)
+celery_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'celery')
+app.config['CAPTURE_BACKEND'] = os.environ.get('CAPTURE_BACKEND', 'local').lower()  # local or celery
+app.config['CELERY_BROKER_URL'] = os.environ.get(
+    'CELERY_BROKER_URL', os.environ.get('REDIS_URL', 'filesystem://')
+)
+app.config['CELERY_RESULT_BACKEND'] = os.environ.get(
+    'CELERY_RESULT_BACKEND', os.environ.get('REDIS_URL', f"file://{os.path.join(celery_dir, 'results')}")
+)
+app.config['CELERY_DATA_DIR'] = os.environ.get('CELERY_DATA_DIR', os.path.join(celery_dir, 'queue'))
+app.config['CAPTURE_TASK_WINDOW'] = int(os.environ.get('CAPTURE_TASK_WINDOW', 64))
+app.config['CAPTURE_TASK_TIMEOUT'] = float(os.environ.get('CAPTURE_TASK_TIMEOUT', 600))
 
 # Database setup
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    """Let SQLite readers and the writer work concurrently.
+    
+    WAL keeps dashboard reads from blocking on progress writes (and the
+    other way round), busy_timeout makes a second writer wait for the lock
+    instead of failing with "database is locked", and synchronous=NORMAL is
+    safe under WAL while saving an fsync per commit.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'] * 1000)}")
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
 # Login manager
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Background processing
-task_queue = queue.Queue()
-worker_thread = None
-worker_running = False
-
 # Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,6 +170,10 @@ class User(db.Model):
     password_hash = db.Column(db.String(120), nullable=False)
     jobs = db.relationship('Job', backref='user', lazy=True)
     
+    @property
+    def is_admin(self):
+        return self.username in app.config['ADMIN_USERS']
+    
     # Flask-Login required properties
     @property
     def is_active(self):
@@ -72,6 +191,11 @@ class User(db.Model):
         return str(self.id)
 
 class Job(db.Model):
+    __table_args__ = (
+        db.Index('ix_job_user_created', 'user_id', 'created_at'),  # dashboard pages
+        db.Index('ix_job_status_created', 'status', 'created_at'),  # queue claims and status counts
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     job_id = db.Column(db.String(36), unique=True, nullable=False)
@@ -84,264 +208,320 @@ class Job(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
     result_file = db.Column(db.String(255))
+    settle_stats = db.Column(db.Text)  # JSON summary of per-route settle times
+    warning_message = db.Column(db.Text)  # rows skipped during route planning
+    cached_routes = db.Column(db.Integer, default=0)  # completed routes served from the screenshot cache
+    filepath = db.Column(db.String(512))  # uploaded workbook, read by whichever worker claims the job
+    claimed_by = db.Column(db.String(128))  # worker holding the job's lease
+    lease_expires_at = db.Column(db.DateTime)  # another worker may take the job over after this
+    heartbeat_at = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)  # when the current claim began
+    attempts = db.Column(db.Integer, default=0)  # times the job has been claimed
+    failed_routes = db.Column(db.Integer, default=0)  # routes that could not be captured
+    render_engine = db.Column(db.String(20), default='chrome')  # chrome (Google Maps) or tiles
+    priority = db.Column(db.Integer, default=0)  # -1 low, 0 normal, 1 high
+    quality_retries = db.Column(db.Integer, default=0)  # captures redone because they looked blank or incomplete
+    flagged_routes = db.Column(db.Integer, default=0)  # completed routes whose last capture still failed the quality checks
+
+class RouteTask(db.Model):
+    """Checkpoint of one route of a job, so a resumed job skips what is already done"""
+    __table_args__ = (
+        db.UniqueConstraint('job_id', 'route_index'),
+        db.Index('ix_route_task_updated', 'updated_at'),  # recent throughput for estimates
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), db.ForeignKey('job.job_id'), nullable=False)
+    route_index = db.Column(db.Integer, nullable=False)  # row position in the Transportation sheet
+    site_id = db.Column(db.String(255))
+    status = db.Column(db.String(20), default='pending')  # pending, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    archive_name = db.Column(db.String(255))  # screenshot's name in the result ZIP
+    cached = db.Column(db.Boolean, default=False)
+    settle_seconds = db.Column(db.Float)
+    duration_seconds = db.Column(db.Float)
+    error_message = db.Column(db.Text)
+    quality_issue = db.Column(db.String(64))  # why the kept screenshot failed the quality checks (blank, grey, consent, ...)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
-def handle_cookie_consent(driver):
-    """Handle Google cookie consent dialog"""
-    try:
-        # Wait for cookie consent dialog to appear
-        wait = WebDriverWait(driver, 10)
-        
-        # Try to find and click "Accept all" button
-        try:
-            accept_button = wait.until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Accept all')]"))
-            )
-            accept_button.click()
-            print("✅ Cookie consent accepted automatically")
-            time.sleep(2)
-            return True
-        except TimeoutException:
-            pass
-        
-        # Try alternative selectors for accept button
-        try:
-            accept_button = driver.find_element(By.XPATH, "//button[contains(@aria-label, 'Accept')]")
-            accept_button.click()
-            print("✅ Cookie consent accepted (alternative method)")
-            time.sleep(2)
-            return True
-        except NoSuchElementException:
-            pass
-        
-        # If no accept button found, try to find and click "Reject all"
-        try:
-            reject_button = driver.find_element(By.XPATH, "//button[contains(., 'Reject all')]")
-            reject_button.click()
-            print("✅ Cookie consent rejected")
-            time.sleep(2)
-            return True
-        except NoSuchElementException:
-            pass
-        
-        print("⚠️ No cookie consent dialog found or handled")
-        return False
-        
-    except Exception as e:
-        print(f"⚠️ Error handling cookie consent: {e}")
-        return False
+def upgrade_schema():
+    """Add columns and indexes introduced after a table was first created.
+    
+    db.create_all() only creates missing tables, so a database created by an
+    older version of the app would otherwise lack newer columns and indexes.
+    """
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(
+                f"ALTER TABLE {preparer.quote(table.name)} "
+                f"ADD COLUMN {preparer.quote(column.name)} {column_type}"
+            ))
+            print(f"✅ Added column {table.name}.{column.name}")
+    db.session.commit()
+    
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine, checkfirst=True)
+                print(f"✅ Added index {index.name}")
 
-def process_screenshots_worker():
-    """Background worker for processing screenshots"""
-    global worker_running
+class ProgressTracker:
+    """In-memory progress of running jobs, written to the Job table in batches.
     
-    print("🔄 Background worker started and ready to process tasks")
+    Capture threads report every route here instead of committing to the
+    database. A job's row is updated at most every PROGRESS_FLUSH_INTERVAL
+    seconds or PROGRESS_FLUSH_EVERY routes, and immediately on start, plan
+    changes and terminal states. /status reads the live numbers from here.
+    Per-route checkpoints are buffered alongside and saved by the same flush.
     
-    while worker_running:
-        try:
-            # Get task from queue
-            task = task_queue.get(timeout=2)
-            if task is None:
-                break
-            
-            job_id, filepath = task
-            print(f"🔄 Processing job: {job_id}")
-            
-            # Verify database connection
-            try:
-                with app.app_context():
-                    # Test database connection
-                    from sqlalchemy import text
-                    db.session.execute(text("SELECT 1"))
-                    print("✅ Database connection verified")
-                    
-                    # Test job retrieval
-                    job = Job.query.filter_by(job_id=job_id).first()
-                    if job:
-                        print(f"✅ Found job: {job.job_id} - Status: {job.status}")
-                    else:
-                        print(f"❌ Job not found: {job_id}")
-                        continue
-                        
-            except Exception as e:
-                print(f"❌ Database connection failed: {e}")
-                continue
-            
+    Captures redone after failing the quality checks are counted in
+    quality_retries; completed routes whose last capture still failed them
+    in flagged_routes.
+    
+    A job started with an owner is only written while that worker still
+    holds its claim, so a worker that lost its lease cannot overwrite the
+    progress of the worker that took the job over.
+    """
+    
+    FIELDS = (
+        'status', 'progress', 'total_routes', 'completed_routes', 'cached_routes', 'failed_routes',
+        'quality_retries', 'flagged_routes', 'warning_message', 'error_message', 'settle_stats', 'completed_at', 'result_file',
+        'lease_expires_at',
+    )
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.jobs = {}
+        self.db_writes = 0
+    
+    def start(self, job_id, **fields):
+        """Begin tracking a job and write its starting state"""
+        entry = {
+            'status': 'processing', 'progress': 0, 'total_routes': 0,
+            'completed_routes': 0, 'cached_routes': 0, 'failed_routes': 0,
+            'quality_retries': 0, 'flagged_routes': 0, 'routes': [], 'pending': 1, 'flushed_at': time.monotonic(),
+            'started': time.monotonic(), 'finished_here': 0,
+        }
+        entry.update(fields)
+        with self.lock:
+            self.jobs[job_id] = entry
+        self.flush(job_id)
+    
+    def update(self, job_id, flush=False, **fields):
+        """Set fields of a tracked job; flush=True writes them right away"""
+        with self.lock:
+            entry = self.jobs.setdefault(
+                job_id, {'routes': [], 'pending': 0, 'flushed_at': time.monotonic()}
+            )
+            entry.update(fields)
+            entry['pending'] += 1
+        if flush:
+            self.flush(job_id)
+    
+    def route_completed(self, job_id, cached=False, checkpoint=None, flagged=False):
+        """Count a finished route (flagged: kept despite failing the quality checks); returns (completed, total)"""
+        return self._route_finished(job_id, 'completed_routes', cached, checkpoint, flagged)
+    
+    def route_failed(self, job_id, checkpoint=None):
+        """Count a route that could not be captured; returns (completed, total)"""
+        return self._route_finished(job_id, 'failed_routes', False, checkpoint)
+    
+    def quality_retry(self, job_id):
+        """Count a capture that failed the quality checks and will be taken again"""
+        with self.lock:
+            entry = self.jobs[job_id]
+            entry['quality_retries'] += 1
+            entry['pending'] += 1
+    
+    def _route_finished(self, job_id, counter, cached, checkpoint, flagged=False):
+        with self.lock:
+            entry = self.jobs[job_id]
+            entry[counter] += 1
+            if cached:
+                entry['cached_routes'] += 1
+            if flagged:
+                entry['flagged_routes'] += 1
+            if checkpoint is not None:
+                entry['routes'].append(checkpoint)
+            completed = entry['completed_routes']
+            finished = completed + entry['failed_routes']
+            total = max(entry['total_routes'] or 0, finished)
+            entry['progress'] = int((finished / total) * 100)
+            if 'started' in entry:
+                # Routes finished by this run, not those resumed from checkpoints
+                entry['finished_here'] += 1
+                elapsed = time.monotonic() - entry['started']
+                if elapsed > 0:
+                    metrics.set_job_rate(job_id, entry['finished_here'] / elapsed)
+            entry['pending'] += 1
+            due = (
+                entry['pending'] >= app.config['PROGRESS_FLUSH_EVERY']
+                or time.monotonic() - entry['flushed_at'] >= app.config['PROGRESS_FLUSH_INTERVAL']
+            )
+        if due:
+            self.flush(job_id)
+        return completed, total
+    
+    def snapshot(self, job_id):
+        """Live values of a tracked job, or None if it is not running here"""
+        with self.lock:
+            entry = self.jobs.get(job_id)
+            if entry is None:
+                return None
+            return {field: entry[field] for field in self.FIELDS if field in entry}
+    
+    def flush(self, job_id):
+        """Write a job's current values to its row with a single UPDATE"""
+        with self.flush_lock:
+            with self.lock:
+                entry = self.jobs.get(job_id)
+                if entry is None or not entry['pending']:
+                    return
+                values = {field: entry[field] for field in self.FIELDS if field in entry}
+                owner = entry.get('owner')
+                routes, entry['routes'] = entry['routes'], []
+                entry['pending'] = 0
+                entry['flushed_at'] = time.monotonic()
             try:
-                with app.app_context():
-                    job = Job.query.filter_by(job_id=job_id).first()
-                    if not job:
-                        continue
-                    
-                    job.status = 'processing'
-                    job.progress = 0
-                    job.completed_routes = 0
+                with app.app_context(), stage_timer.measure('db_commit'):
+                    query = Job.query.filter_by(job_id=job_id)
+                    if owner is not None:
+                        query = query.filter_by(claimed_by=owner)
+                    updated = query.update(values, synchronize_session=False)
+                    if routes and updated:
+                        save_route_checkpoints(job_id, routes)
                     db.session.commit()
-                
-                # Read Excel file
-                excel_data = pd.read_excel(filepath, sheet_name=None)
-                
-                # Validate required sheets
-                required_sheets = ['Transportation', 'Warehouse', 'Region']
-                for sheet in required_sheets:
-                    if sheet not in excel_data:
-                        raise ValueError(f"Missing required sheet: {sheet}")
-                
-                # Process data
-                transportation_df = excel_data['Transportation']
-                warehouse_df = excel_data['Warehouse']
-                region_df = excel_data['Region']
-                
-                total_routes = len(transportation_df)
-                print(f"📊 Total routes to process: {total_routes}")
-                
-                # Update total routes immediately
-                with app.app_context():
-                    job = Job.query.filter_by(job_id=job_id).first()
-                    if job:
-                        job.total_routes = total_routes
-                        db.session.commit()
-                        print(f"✅ Updated total_routes to {total_routes}")
-                    else:
-                        print(f"❌ Could not find job {job_id} to update total_routes")
-                
-                # Small delay to ensure database is updated
-                time.sleep(0.5)
-                
-                # Setup Chrome - NOW headless since cookies are handled automatically
-                chrome_options = Options()
-                chrome_options.add_argument("--headless")  # ENABLED: Headless mode for faster processing
-                chrome_options.add_argument("--no-sandbox")
-                chrome_options.add_argument("--disable-dev-shm-usage")
-                chrome_options.add_argument("--window-size=1920,1080")
-                chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-                chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-                chrome_options.add_experimental_option('useAutomationExtension', False)
-                
-                driver = webdriver.Chrome(options=chrome_options)
-                driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-                
-                screenshots_dir = f"screenshots/{job_id}"
-                os.makedirs(screenshots_dir, exist_ok=True)
-                
-                completed = 0
-                
-                try:
-                    for index, row in transportation_df.iterrows():
-                        try:
-                            # Get coordinates (using correct column names from Excel)
-                            lat = row['latitude']
-                            lng = row['longitude']
-                            site_id = row['ID']
-                            warehouse_name = row['warehouse']
-                            
-                            # Find warehouse coordinates
-                            warehouse_row = warehouse_df[warehouse_df['Warehouse'] == warehouse_name]
-                            if warehouse_row.empty:
-                                continue
-                            
-                            warehouse_lat = warehouse_row.iloc[0]['latitude']
-                            warehouse_lng = warehouse_row.iloc[0]['longitude']
-                            
-                            # Generate Google Maps URL (latitude,longitude format)
-                            url = f"https://www.google.com/maps/dir/{warehouse_lat},{warehouse_lng}/{lat},{lng}"
-                            
-                            print(f"📍 Processing route {completed + 1}/{total_routes}: {site_id}")
-                            
-                            # Navigate to page
-                            driver.get(url)
-                            time.sleep(3)  # Wait for page to load
-                            
-                            # Handle cookie consent on first page load
-                            if completed == 0:
-                                handle_cookie_consent(driver)
-                                time.sleep(2)
-                            
-                            # Wait for maps to load
-                            time.sleep(5)
-                            
-                            # Take screenshot
-                            screenshot_path = os.path.join(screenshots_dir, f"route_{site_id}.png")
-                            driver.save_screenshot(screenshot_path)
-                            
-                            completed += 1
-                            
-                            # Update progress more frequently
-                            progress = int((completed / total_routes) * 100)
-                            try:
-                                with app.app_context():
-                                    # Refresh job from database
-                                    job = Job.query.filter_by(job_id=job_id).first()
-                                    if job:
-                                        job.progress = progress
-                                        job.completed_routes = completed
-                                        db.session.commit()
-                                        print(f"📊 Progress: {progress}% ({completed}/{total_routes})")
-                                    else:
-                                        print(f"❌ Could not find job {job_id} for progress update")
-                                
-                                # Force a small delay to ensure database is updated
-                                time.sleep(0.1)
-                            except Exception as e:
-                                print(f"❌ Error updating progress: {e}")
-                            
-                        except Exception as e:
-                            print(f"❌ Error processing route {index}: {e}")
-                            continue
-                    
-                    # Create ZIP file
-                    zip_path = f"screenshots/{job_id}_routes.zip"
-                    with zipfile.ZipFile(zip_path, 'w') as zipf:
-                        for filename in os.listdir(screenshots_dir):
-                            if filename.endswith('.png'):
-                                filepath = os.path.join(screenshots_dir, filename)
-                                zipf.write(filepath, filename)
-                    
-                    # Update job status
-                    with app.app_context():
-                        job = Job.query.filter_by(job_id=job_id).first()
-                        if job:
-                            job.status = 'completed'
-                            job.progress = 100
-                            job.completed_at = datetime.utcnow()
-                            job.result_file = zip_path
-                            db.session.commit()
-                            print(f"✅ Job completed: {job_id}")
-                        else:
-                            print(f"❌ Could not find job {job_id} to mark as completed")
-                    
-                finally:
-                    driver.quit()
-                    
+                self.db_writes += 1
             except Exception as e:
-                # Update job status on error
-                with app.app_context():
-                    job = Job.query.filter_by(job_id=job_id).first()
-                    if job:
-                        job.status = 'failed'
-                        job.error_message = str(e)
-                        db.session.commit()
-                        print(f"❌ Job failed: {job_id} - {e}")
-            
-            # Mark task as done
-            task_queue.task_done()
-            
-        except Exception as e:
-            print(f"Worker error: {e}")
-            continue
+                print(f"❌ Error saving progress for job {job_id}: {e}")
+                with self.lock:
+                    entry['pending'] += 1
+                    entry['routes'][:0] = routes
+    
+    def finish(self, job_id, **fields):
+        """Write a terminal state and stop tracking the job"""
+        self.update(job_id, flush=True, **fields)
+        self.discard(job_id)
+    
+    def discard(self, job_id):
+        """Stop tracking a job without writing anything"""
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        metrics.clear_job_rate(job_id)
+
+progress_tracker = ProgressTracker()
+
+def save_route_checkpoints(job_id, checkpoints):
+    """Replace the checkpoints of the given routes (no commit)"""
+    # A rerun route may have a checkpoint already; the latest one wins
+    latest = {checkpoint['route_index']: checkpoint for checkpoint in checkpoints}
+    RouteTask.query.filter(
+        RouteTask.job_id == job_id, RouteTask.route_index.in_(list(latest))
+    ).delete(synchronize_session=False)
+    db.session.execute(RouteTask.__table__.insert(), list(latest.values()))
+
+def load_route_checkpoints(job_id):
+    """Status, attempts, archive name, cache use and quality issue of a job's checkpointed routes, by route index"""
+    with app.app_context():
+        rows = (
+            RouteTask.query.filter_by(job_id=job_id)
+            .with_entities(
+                RouteTask.route_index, RouteTask.status, RouteTask.attempts,
+                RouteTask.archive_name, RouteTask.cached, RouteTask.quality_issue,
+            )
+            .all()
+        )
+    return {row.route_index: row for row in rows}
 
-def start_worker():
-    """Start the background worker"""
-    global worker_thread, worker_running
+def summarize_durations(values):
+    """Summarize a list of durations in seconds (count, mean, percentiles, max)"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    
+    def percentile(p):
+        rank = max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1)
+        return round(ordered[min(rank, len(ordered) - 1)], 3)
     
-    if worker_thread is None or not worker_thread.is_alive():
-        worker_running = True
-        worker_thread = threading.Thread(target=process_screenshots_worker, daemon=True)
-        worker_thread.start()
-        print("✅ Background worker started")
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': round(ordered[-1], 3),
+    }
+
+class StageTimer:
+    """Recent durations of each pipeline stage (navigate, settle, screenshot, ...) in this process.
+    
+    Keeps the last `keep` samples per stage; /debug and the benchmark read
+    their percentiles. Every sample is also observed by the route_stage_seconds
+    histogram on /metrics.
+    """
+    
+    def __init__(self, keep=10000):
+        self.lock = threading.Lock()
+        self.keep = keep
+        self.samples = {}
+    
+    def record(self, stage, seconds):
+        metrics.stage_seconds.labels(stage).observe(seconds)
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.keep)
+            self.samples[stage].append(seconds)
+    
+    @contextmanager
+    def measure(self, stage):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, time.monotonic() - started)
+    
+    def summary(self):
+        with self.lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+        return {stage: summarize_durations(values) for stage, values in samples.items()}
+    
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+stage_timer = StageTimer()
+
+JOB_PRIORITIES = {-1: 'Low', 0: 'Normal', 1: 'High'}
+
+def allowed_priorities(user):
+    """Priorities a user may pick for an upload: High jumps the queue, so only admins (ADMIN_USERS) get it"""
+    return {value: label for value, label in JOB_PRIORITIES.items() if value <= 0 or user.is_admin}
+
+def priority_weight(priority):
+    """Share of the capture slots a job's user gets relative to a normal priority job"""
+    return 2.0 ** max(-1, min(1, priority or 0))
+
+# Ways of producing a route image, selectable per job
+RENDER_ENGINES = {
+    'chrome': 'Google Maps (Chrome)',
+    'tiles': 'Local map tiles (fast, straight line)',
+}
 
 @app.route('/')
 def index():
@@ -395,107 +575,551 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.created_at.desc()).all()
-    return render_template('dashboard.html', jobs=jobs)
+    jobs, newer, older = dashboard_page(
+        current_user.id, request.args.get('before', type=int), request.args.get('after', type=int)
+    )
+    estimates = {}
+    if any(job.status in ACTIVE_STATUSES for job in jobs):
+        estimates = {
+            job_id: {
+                'start': format_wait(start) if start is not None else None,
+                'finish': format_wait(finish),
+            }
+            for job_id, (start, finish) in estimate_schedule().items()
+        }
+    return render_template(
+        'dashboard.html', jobs=jobs, newer=newer, older=older, counts=job_status_counts(current_user.id),
+        estimates=estimates, priorities=JOB_PRIORITIES,
+    )
+
+DASHBOARD_PAGE_SIZE = 50
+
+def dashboard_page(user_id, before=None, after=None):
+    """One page of a user's jobs, newest first, by keyset on (created_at, id).
+    
+    before/after are the id of the last/first job of the page the user came
+    from. Returns (jobs, newer, older) where newer and older are the cursors
+    for the neighbouring pages, or None at either end.
+    """
+    query = Job.query.filter(Job.user_id == user_id)
+    cursor_id = before or after
+    cursor = db.session.get(Job, cursor_id) if cursor_id else None
+    if cursor is None or cursor.user_id != user_id:
+        before = after = cursor = None
+    
+    if after is not None:
+        # Walk towards newer jobs, then put the page back in display order
+        query = query.filter(or_(
+            Job.created_at > cursor.created_at,
+            and_(Job.created_at == cursor.created_at, Job.id > cursor.id),
+        )).order_by(Job.created_at, Job.id)
+    else:
+        if cursor is not None:
+            query = query.filter(or_(
+                Job.created_at < cursor.created_at,
+                and_(Job.created_at == cursor.created_at, Job.id < cursor.id),
+            ))
+        query = query.order_by(Job.created_at.desc(), Job.id.desc())
+    
+    jobs = query.limit(DASHBOARD_PAGE_SIZE + 1).all()
+    more = len(jobs) > DASHBOARD_PAGE_SIZE
+    jobs = jobs[:DASHBOARD_PAGE_SIZE]
+    if after is not None:
+        if not more:
+            # Back at the newest jobs: show a full first page
+            return dashboard_page(user_id)
+        jobs.reverse()
+        return jobs, jobs[0].id, jobs[-1].id
+    
+    newer = jobs[0].id if before is not None and jobs else None
+    older = jobs[-1].id if more else None
+    return jobs, newer, older
 
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
     if request.method == 'POST':
+        # pandas comes with the readers, so only web processes that take uploads load it
+        from ingest import READERS, route_reader
+        from planning import check_routes
+        
         # Ensure database exists
         try:
             db.create_all()
+            upgrade_schema()
         except Exception as e:
             print(f"Database creation error: {e}")
         
         if 'file' not in request.files:
             flash('No file selected')
-            return render_template('upload.html')
+            return render_template('upload.html', render_engines=RENDER_ENGINES, priorities=allowed_priorities(current_user))
         
         file = request.files['file']
         if file.filename == '':
             flash('No file selected')
-            return render_template('upload.html')
+            return render_template('upload.html', render_engines=RENDER_ENGINES, priorities=allowed_priorities(current_user))
         
-        if file and file.filename.endswith('.xlsx'):
-            filename = secure_filename(file.filename)
-            
-            # Save file
-            upload_dir = 'uploads'
-            os.makedirs(upload_dir, exist_ok=True)
-            filepath = os.path.join(upload_dir, filename)
-            file.save(filepath)
-            
-            # Create job
-            job_id = str(uuid.uuid4())
-            job = Job(
-                user_id=current_user.id,
-                job_id=job_id,
-                filename=filename,
-                status='pending'
-            )
-            db.session.add(job)
-            db.session.commit()
-            
-            # Add to processing queue
-            task_queue.put((job_id, filepath))
-            
-            flash('File uploaded successfully! Processing started.')
-            return redirect(url_for('dashboard'))
-        else:
-            flash('Please upload an Excel (.xlsx) file')
+        render_engine = request.form.get('render_engine', 'chrome')
+        if render_engine not in RENDER_ENGINES:
+            flash('Unknown render engine')
+            return render_template('upload.html', render_engines=RENDER_ENGINES, priorities=allowed_priorities(current_user))
+        
+        try:
+            priority = int(request.form.get('priority', 0))
+        except ValueError:
+            priority = None
+        if priority not in allowed_priorities(current_user):
+            flash('Unknown priority' if priority not in JOB_PRIORITIES else 'Only administrators can queue High priority jobs')
+            return render_template('upload.html', render_engines=RENDER_ENGINES, priorities=allowed_priorities(current_user))
+        
+        filename = secure_filename(file.filename)
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in READERS:
+            flash('Please upload an Excel (.xlsx), CSV (.csv) or Parquet (.parquet) file')
+            return render_template('upload.html', render_engines=RENDER_ENGINES, priorities=allowed_priorities(current_user))
+        
+        # Same content, same path: re-uploading a file reuses the stored copy
+        filepath, created = save_upload(file, app.config['UPLOAD_DIR'], extension)
+        
+        # Check headers and plan every row now, so a bad file is reported here
+        # instead of failing in the worker, and the job starts with its total
+        # and the rows it will skip
+        try:
+            with route_reader(filepath) as reader:
+                checked = check_routes(
+                    reader.iter_chunks('Transportation', app.config['INGEST_CHUNK_SIZE']),
+                    reader.read_sheet('Warehouse'),
+                    app.config['MAPS_BASE_URL'],
+                )
+            if not checked.total_rows:
+                raise ValueError('The file has no Transportation rows')
+            if not checked.route_count:
+                raise ValueError(f"No routes to capture: {checked.describe_skipped()}")
+            total_routes = checked.route_count
+        except Exception as e:
+            if created:
+                os.remove(filepath)
+            flash(f'Could not use {filename}: {e}')
+            return render_template('upload.html', render_engines=RENDER_ENGINES, priorities=allowed_priorities(current_user))
+        
+        # Create job; a worker claims it from the table
+        job = Job(
+            user_id=current_user.id,
+            job_id=str(uuid.uuid4()),
+            filename=filename,
+            filepath=filepath,
+            render_engine=render_engine,
+            priority=priority,
+            total_routes=total_routes,
+            warning_message=checked.describe_skipped(),
+            status='pending'
+        )
+        db.session.add(job)
+        db.session.commit()
+        
+        flash(f'File uploaded successfully! {total_routes} routes queued for processing.')
+        if checked.skipped_count:
+            flash(f'Skipping {checked.skipped_count} rows: {checked.describe_skipped()}')
+        return redirect(url_for('dashboard'))
+    
+    return render_template('upload.html', render_engines=RENDER_ENGINES, priorities=allowed_priorities(current_user))
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def save_upload(file, upload_dir, extension):
+    """Stream an uploaded file to upload_dir/<sha256><extension>.
     
-    return render_template('upload.html')
+    The file is copied in chunks while it is hashed, so it is never held in
+    memory. Returns (path, created) where created is False if a file with
+    the same content was already stored.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    temporary = os.path.join(upload_dir, f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temporary, 'wb') as output:
+            for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                output.write(chunk)
+        path = os.path.join(upload_dir, digest.hexdigest() + extension)
+        if os.path.exists(path):
+            return path, False
+        os.replace(temporary, path)
+        return path, True
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    flash(f"File is too large, the limit is {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB")
+    return redirect(url_for('upload'))
+
+ACTIVE_STATUSES = ('pending', 'processing')
+
+def job_status_payload(job):
+    """Status of a job as returned by /status and pushed by /events"""
+    status = {
+        'status': job.status,
+        'progress': job.progress,
+        'total_routes': job.total_routes,
+        'completed_routes': job.completed_routes,
+        'cached_routes': job.cached_routes or 0,
+        'failed_routes': job.failed_routes or 0,
+        'quality_retries': job.quality_retries or 0,
+        'flagged_routes': job.flagged_routes or 0,
+        'error_message': job.error_message,
+        'warning_message': job.warning_message,
+        'settle_stats': job.settle_stats,
+    }
+    # A job running in this process has fresher numbers than its row
+    live = progress_tracker.snapshot(job.job_id)
+    if live:
+        status.update({field: value for field, value in live.items() if field in status})
+    status['settle_stats'] = json.loads(status['settle_stats']) if status['settle_stats'] else None
+    return status
+
+def job_status_counts(user_id=None):
+    """Number of a user's jobs (or everyone's) per status, from a single GROUP BY query"""
+    query = db.session.query(Job.status, func.count(Job.id))
+    if user_id is not None:
+        query = query.filter(Job.user_id == user_id)
+    rows = query.group_by(Job.status).all()
+    counts = {'pending': 0, 'processing': 0, 'completed': 0, 'failed': 0}
+    for status, count in rows:
+        counts[status] = count
+    counts['total'] = sum(count for _, count in rows)
+    return counts
+
+def route_throughput():
+    """Routes per second all workers together capture, or None if there is nothing to go by.
+    
+    Measured from the routes checkpointed as captured (not served from the
+    cache) in the last ETA_WINDOW_SECONDS. When too few were captured
+    lately it is estimated from how long recent routes took to capture and
+    the number of capture slots.
+    """
+    now = datetime.utcnow()
+    captured = and_(RouteTask.status == 'done', RouteTask.cached.is_(False))
+    count, first = (
+        db.session.query(func.count(RouteTask.id), func.min(RouteTask.updated_at))
+        .filter(captured, RouteTask.updated_at >= now - timedelta(seconds=app.config['ETA_WINDOW_SECONDS']))
+        .one()
+    )
+    if count >= 10:
+        return count / max(1.0, (now - first).total_seconds())
+    
+    recent = (
+        db.session.query(RouteTask.duration_seconds)
+        .filter(captured, RouteTask.duration_seconds > 0)
+        .order_by(RouteTask.updated_at.desc())
+        .limit(200)
+        .subquery()
+    )
+    mean_seconds = db.session.query(func.avg(recent.c.duration_seconds)).scalar()
+    if not mean_seconds:
+        return None
+    return max(1, app.config['CAPTURE_SLOTS']) / mean_seconds
+
+def estimate_schedule():
+    """Estimated seconds until each pending or processing job starts and finishes.
+    
+    Replays the scheduling policy on the routes left at the measured
+    throughput: users share it in proportion to the priority weight of
+    their current job, and a user's jobs run one after another (running
+    jobs first, then by priority and age). Returns {job_id: (start, finish)}
+    with start None for jobs already running, or {} while there is no
+    throughput to go by.
+    """
+    rate = route_throughput()
+    if not rate:
+        return {}
+    
+    jobs = (
+        db.session.query(
+            Job.id, Job.job_id, Job.user_id, Job.status, Job.priority,
+            Job.total_routes, Job.completed_routes, Job.failed_routes,
+        )
+        .filter(Job.status.in_(ACTIVE_STATUSES))
+        .all()
+    )
+    queues = {}
+    for job in jobs:
+        live = progress_tracker.snapshot(job.job_id) or {}
+        finished = (live.get('completed_routes', job.completed_routes) or 0) + (live.get('failed_routes', job.failed_routes) or 0)
+        queues.setdefault(job.user_id, []).append({
+            'job_id': job.job_id,
+            'running': job.status == 'processing',
+            'weight': priority_weight(job.priority),
+            'order': (job.status != 'processing', -(job.priority or 0), job.id),
+            'remaining': max(0, (live.get('total_routes', job.total_routes) or 0) - finished),
+        })
+    for queue in queues.values():
+        queue.sort(key=lambda entry: entry['order'])
+    
+    clock = 0.0
+    estimates = {}
+    while queues:
+        heads = {user_id: queue[0] for user_id, queue in queues.items()}
+        total_weight = sum(head['weight'] for head in heads.values())
+        for head in heads.values():
+            head.setdefault('start', clock)
+            head['rate'] = rate * head['weight'] / total_weight
+        # Advance to the next time a user's current job finishes
+        step = min(head['remaining'] / head['rate'] for head in heads.values())
+        clock += step
+        for user_id, head in heads.items():
+            head['remaining'] -= head['rate'] * step
+            if head['remaining'] <= 1e-6:
+                estimates[head['job_id']] = (None if head['running'] else head['start'], clock)
+                queues[user_id].pop(0)
+                if not queues[user_id]:
+                    del queues[user_id]
+    return estimates
+
+def format_wait(seconds):
+    """Rough human readable duration ("~5 min", "~2 h 10 min")"""
+    minutes = max(1, int(round(seconds / 60)))
+    if minutes < 60:
+        return f"~{minutes} min"
+    hours, minutes = divmod(minutes, 60)
+    return f"~{hours} h {minutes} min" if minutes else f"~{hours} h"
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
 @app.route('/status/<job_id>')
 @login_required
 def job_status(job_id):
     job = Job.query.filter_by(job_id=job_id, user_id=current_user.id).first()
     if job:
-        return jsonify({
-            'status': job.status,
-            'progress': job.progress,
-            'total_routes': job.total_routes,
-            'completed_routes': job.completed_routes,
-            'error_message': job.error_message
-        })
+        return jsonify(job_status_payload(job))
     return jsonify({'error': 'Job not found'}), 404
 
+@app.route('/summary')
+@login_required
+def job_summary():
+    """Summary card counts for the dashboard"""
+    return jsonify(job_status_counts(current_user.id))
+
+@app.route('/events')
+@login_required
+def job_events():
+    """Server-Sent Events stream of the current user's active jobs.
+    
+    A 'progress' event maps job IDs to the fields that changed since the
+    previous event (the first one carries full state), a 'summary' event
+    carries the summary card counts whenever they change, and an 'idle'
+    event ends the stream once no job is pending or processing. Streams are
+    also closed after EVENTS_MAX_SECONDS, short enough to stay inside the
+    web server's request timeout; browsers reconnect on their own and get
+    full state again.
+    """
+    user_id = current_user.id
+    interval = app.config['EVENTS_POLL_INTERVAL']
+    max_seconds = app.config['EVENTS_MAX_SECONDS']
+    
+    def stream():
+        sent = {}
+        sent_summary = None
+        started = last_write = time.monotonic()
+        yield "retry: 1000\n\n"
+        
+        try:
+            while time.monotonic() - started < max_seconds:
+                # Active jobs, plus those that just left the active states so
+                # their final status is delivered once
+                jobs = Job.query.filter(
+                    Job.user_id == user_id,
+                    or_(Job.status.in_(ACTIVE_STATUSES), Job.job_id.in_(list(sent)))
+                ).all()
+                
+                deltas = {}
+                for job in jobs:
+                    status = job_status_payload(job)
+                    previous = sent.get(job.job_id, {})
+                    delta = {field: value for field, value in status.items() if previous.get(field) != value}
+                    if delta:
+                        deltas[job.job_id] = delta
+                    if status['status'] in ACTIVE_STATUSES:
+                        sent[job.job_id] = status
+                    else:
+                        sent.pop(job.job_id, None)
+                
+                summary = job_status_counts(user_id)
+                # End the read transaction so SQLite does not hold its lock between ticks
+                db.session.rollback()
+                
+                if deltas:
+                    yield server_sent_event('progress', deltas)
+                    last_write = time.monotonic()
+                if summary != sent_summary:
+                    yield server_sent_event('summary', summary)
+                    sent_summary = summary
+                    last_write = time.monotonic()
+                
+                if not sent:
+                    yield server_sent_event('idle', {})
+                    return
+                if time.monotonic() - last_write >= 15:
+                    yield ": keepalive\n\n"
+                    last_write = time.monotonic()
+                time.sleep(interval)
+        finally:
+            db.session.remove()
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/retry/<int:job_id>', methods=['POST'])
+@login_required
+def retry_job(job_id):
+    """Queue a finished job again; routes already captured are skipped"""
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        flash('Job not found')
+        return redirect(url_for('dashboard'))
+    if job.status in ACTIVE_STATUSES:
+        flash('This job is still running')
+        return redirect(url_for('dashboard'))
+    if not job.filepath or not os.path.exists(job.filepath):
+        flash('The uploaded file is no longer available, please upload it again')
+        return redirect(url_for('dashboard'))
+    
+    retried = RouteTask.query.filter_by(job_id=job.job_id, status='failed').update(
+        {'status': 'pending'}, synchronize_session=False
+    )
+    job.status = 'pending'
+    job.error_message = None
+    job.failed_routes = 0
+    job.completed_at = None
+    job.claimed_by = None
+    job.lease_expires_at = None
+    job.attempts = 0
+    db.session.commit()
+    
+    flash(f'Retrying {retried} failed routes' if retried else 'Resuming job')
+    return redirect(url_for('dashboard'))
+
 @app.route('/download/<int:job_id>')
 @login_required
 def download(job_id):
     job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
     
     if job and job.result_file and os.path.exists(job.result_file):
-        return send_file(job.result_file, as_attachment=True)
+        if job.status in ACTIVE_STATUSES:
+            # Still running: stream the screenshots captured so far as a fresh ZIP
+            return Response(
+                stream_with_context(stream_zip(iter_archive_entries(job.result_file))),
+                mimetype='application/zip',
+                headers={
+                    'Content-Disposition': f'attachment; filename="{job.job_id}_routes_partial.zip"',
+                },
+            )
+        return send_file(os.path.abspath(job.result_file), as_attachment=True)
     else:
         flash('File not found or job not completed')
         return redirect(url_for('dashboard'))
 
+PREVIEW_LIMIT = 200
+
+@app.route('/preview/<int:job_id>')
+@login_required
+def preview(job_id):
+    """Thumbnails of a job's screenshots (the first PREVIEW_LIMIT of them)"""
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        flash('Job not found')
+        return redirect(url_for('dashboard'))
+    
+    directory = os.path.join(app.config['THUMBNAIL_DIR'], job.job_id)
+    names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    return render_template('preview.html', job=job, thumbnails=names[:PREVIEW_LIMIT], total=len(names))
+
+@app.route('/thumbnail/<int:job_id>/<path:filename>')
+@login_required
+def thumbnail(job_id, filename):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        abort(404)
+    directory = os.path.abspath(os.path.join(app.config['THUMBNAIL_DIR'], job.job_id))
+    return send_from_directory(directory, filename)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    # Queue depth and job counts come from the database, so every process reports the same
+    counts = job_status_counts()
+    for status in ('pending', 'processing', 'completed', 'failed'):
+        metrics.jobs_by_status.labels(status).set(counts[status])
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
 @app.route('/debug')
 @login_required
 def debug_info():
     """Debug endpoint to check worker status"""
-    return jsonify({
-        'worker_running': worker_running,
-        'worker_thread_alive': worker_thread.is_alive() if worker_thread else False,
-        'queue_size': task_queue.qsize(),
-        'worker_thread_id': worker_thread.ident if worker_thread else None,
-        'jobs_count': Job.query.count(),
-        'pending_jobs': Job.query.filter_by(status='pending').count(),
-        'processing_jobs': Job.query.filter_by(status='processing').count(),
-        'completed_jobs': Job.query.filter_by(status='completed').count(),
-        'failed_jobs': Job.query.filter_by(status='failed').count()
-    })
+    now = datetime.utcnow()
+    oldest_pending = db.session.query(func.min(Job.created_at)).filter(Job.status == 'pending').scalar()
+    recent_starts = (
+        db.session.query(Job.created_at, Job.started_at)
+        .filter(Job.started_at.isnot(None))
+        .order_by(Job.started_at.desc())
+        .limit(50)
+        .all()
+    )
+    waits = [(started - created).total_seconds() for created, started in recent_starts if created]
+    claims = (
+        Job.query.filter_by(status='processing')
+        .with_entities(Job.job_id, Job.claimed_by, Job.heartbeat_at, Job.lease_expires_at)
+        .all()
+    )
+    counts = job_status_counts()
+    info = {
+        'queue_size': counts['pending'],
+        'oldest_pending_seconds': (now - oldest_pending).total_seconds() if oldest_pending else None,
+        'queue_wait_seconds': summarize_durations(waits),
+        'claimed_jobs': [
+            {
+                'job_id': claim.job_id,
+                'claimed_by': claim.claimed_by,
+                'heartbeat_at': claim.heartbeat_at.isoformat() if claim.heartbeat_at else None,
+                'lease_expired': claim.lease_expires_at is None or claim.lease_expires_at < now,
+            }
+            for claim in claims
+        ],
+        'routes_per_second': route_throughput(),
+        'jobs_count': counts['total'],
+        'pending_jobs': counts['pending'],
+        'processing_jobs': counts['processing'],
+        'completed_jobs': counts['completed'],
+        'failed_jobs': counts['failed'],
+    }
+    worker = sys.modules.get('worker')
+    if worker is not None:
+        # The capture worker runs in this process (python app.py)
+        info['capture_worker'] = 'in this process'
+        info.update(worker.worker_stats())
+    else:
+        # Stage timings, progress writes and Chrome state live in the worker process
+        info['capture_worker'] = 'separate process: see its /metrics (WORKER_METRICS_PORT)'
+    return jsonify(info)
 
 if __name__ == '__main__':
     # Create database tables
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         print("✅ Database tables created successfully")
     
-    # Start background worker
-    start_worker()
+    # Development server: run the capture worker in this process too. Under
+    # gunicorn/waitress the worker is a separate process (python worker.py)
+    sys.modules.setdefault('app', sys.modules[__name__])  # so worker.py shares this app
+    import worker
+    worker.start_worker()
     
     print("🚀 Starting Route Screenshot Generator (Fixed Version)")
     print("📝 Note: This version handles cookie consent and fixes progress updates")
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for Route Screenshot Generator
+Runs real jobs through the worker against a local stand-in for Google Maps and reports
+routes/minute, per-stage latency percentiles, peak RSS and database writes
+
+Usage:
+    python benchmark.py                              # 10, 1000 and 10000 rows through Chrome
+    python benchmark.py --rows 10 100 --render-delay 0.5 --jitter 0.2 --consent
+    python benchmark.py --engine tiles --rows 10000  # browser-free renderer
+    python benchmark.py --startup                    # cold start and RSS of the web and worker processes
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from openpyxl import Workbook
+
+from chrome_watchdog import process_tree_rss
+from ingest import WorkbookReader
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_WORKBOOK = os.path.join(BASE_DIR, 'material.xlsx')
+
+# Directions page of the fake maps server. After the render delay it fetches
+# a "tile" (so the settle probe sees network activity), then adds the
+# directions panel and paints a canvas, like Google Maps does: streets, water
+# and a park around the route, so captures pass the quality checks. Like Maps it
+# re-renders the route in place when the URL changes through the History API.
+ROUTE_PAGE = """<!DOCTYPE html>
+<html><head><title>Fake Maps</title>
+<style>
+body {{ margin: 0; font-family: sans-serif; }}
+#panel {{ position: absolute; left: 0; top: 0; width: 408px; height: 100%; background: #fff; }}
+#consent {{ position: fixed; inset: 0; background: rgba(0,0,0,.5); display: flex;
+           align-items: center; justify-content: center; }}
+</style></head>
+<body>
+<div id="panel"></div>
+{consent}
+<script>
+function render() {{
+    const parts = location.pathname.split('/');
+    fetch('/maps/vt?r=' + Math.random()).then(() => {{
+        const trip = document.createElement('div');
+        trip.id = 'section-directions-trip-0';
+        trip.textContent = parts[3] + ' to ' + parts[4];
+        document.getElementById('panel').appendChild(trip);
+        const canvas = document.createElement('canvas');
+        canvas.width = window.innerWidth;
+        canvas.height = window.innerHeight;
+        document.body.insertBefore(canvas, document.body.firstChild);
+        const context = canvas.getContext('2d');
+        context.fillStyle = '#f2efe9';
+        context.fillRect(0, 0, canvas.width, canvas.height);
+        context.fillStyle = '#aadaff';
+        context.fillRect(900, 650, 700, 430);
+        context.fillStyle = '#c5e8c5';
+        context.fillRect(1200, 80, 400, 260);
+        context.strokeStyle = '#fff';
+        context.lineWidth = 8;
+        for (let x = 480; x < canvas.width; x += 160) {{
+            context.beginPath();
+            context.moveTo(x, 0);
+            context.lineTo(x + 120, canvas.height);
+            context.stroke();
+        }}
+        for (let y = 60; y < canvas.height; y += 140) {{
+            context.beginPath();
+            context.moveTo(0, y);
+            context.lineTo(canvas.width, y + 40);
+            context.stroke();
+        }}
+        context.strokeStyle = '#1a73e8';
+        context.lineWidth = 6;
+        context.beginPath();
+        context.moveTo(600, 300);
+        context.lineTo(1500, 800);
+        context.stroke();
+    }});
+}}
+window.addEventListener('popstate', () => {{
+    document.querySelectorAll('[id^="section-directions-trip-"], canvas').forEach(element => element.remove());
+    setTimeout(render, {delay});
+}});
+{start}
+</script>
+</body></html>
+"""
+
+CONSENT_DIALOG = """<div id="consent"><div style="background:#fff;padding:24px">
+<p>Before you continue</p>
+<button onclick="document.cookie='CONSENT=YES+; path=/'; location.reload()">Accept all</button>
+<button onclick="document.cookie='CONSENT=NO; path=/'; location.reload()">Reject all</button>
+</div></div>"""
+
+
+class FakeMapsHandler(BaseHTTPRequestHandler):
+    """Serves /maps/dir/<lat>,<lng>/<lat>,<lng> pages and the resources they load"""
+
+    settings = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='text/html; charset=utf-8'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        settings = self.settings
+        path = urlparse(self.path).path
+        parts = path.strip('/').split('/')
+
+        if path.startswith('/maps/vt'):
+            time.sleep(settings['tile_delay'])
+            self.send_body(200, '', 'image/png')
+            return
+        if len(parts) != 4 or parts[:2] != ['maps', 'dir']:
+            self.send_body(404, 'Not found')
+            return
+
+        if random.random() < settings['failure_rate']:
+            self.send_body(500, '<html><body>Server error</body></html>')
+            return
+
+        consented = 'CONSENT=' in (self.headers.get('Cookie') or '')
+        show_consent = settings['consent'] and not consented
+        delay = max(0.0, settings['render_delay'] + random.uniform(-settings['jitter'], settings['jitter']))
+        self.send_body(200, ROUTE_PAGE.format(
+            delay=int(delay * 1000),
+            consent=CONSENT_DIALOG if show_consent else '',
+            start='' if show_consent else f"setTimeout(render, {int(delay * 1000)});",
+        ))
+
+
+def start_fake_maps_server(render_delay, jitter, tile_delay, consent, failure_rate):
+    """Start the fake maps server on a free local port; returns (server, base_url)"""
+    FakeMapsHandler.settings = {
+        'render_delay': render_delay,
+        'jitter': jitter,
+        'tile_delay': tile_delay,
+        'consent': consent,
+        'failure_rate': failure_rate,
+    }
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMapsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/maps"
+
+
+def generate_workbook(path, rows, seed=0):
+    """Write a workbook of `rows` Transportation rows in the schema of material.xlsx.
+
+    Sites are the schema workbook's sites, cycled with a small random offset
+    (so the screenshot cache cannot serve repeats) and fresh IDs; the
+    Warehouse sheet is copied as is.
+    """
+    rng = random.Random(seed)
+    with WorkbookReader(SCHEMA_WORKBOOK) as schema:
+        sites = schema.read_sheet('Transportation').to_dict('records')
+        warehouses = schema.read_sheet('Warehouse')
+
+    workbook = Workbook(write_only=True)
+    transportation = workbook.create_sheet('Transportation')
+    transportation.append(['ID', 'latitude', 'longitude', 'warehouse'])
+    for i in range(rows):
+        site = sites[i % len(sites)]
+        transportation.append([
+            100000 + i,
+            round(float(site['latitude']) + rng.uniform(-0.02, 0.02), 6),
+            round(float(site['longitude']) + rng.uniform(-0.02, 0.02), 6),
+            site['warehouse'],
+        ])
+
+    warehouse = workbook.create_sheet('Warehouse')
+    warehouse.append(['Warehouse', 'latitude', 'longitude'])
+    for row in warehouses.itertuples(index=False):
+        warehouse.append([row.Warehouse, row.latitude, row.longitude])
+
+    region = workbook.create_sheet('Region')
+    region.append(['region'])
+    workbook.save(path)
+
+
+class PeakMemorySampler:
+    """Samples the RSS of this process tree (Chrome and image workers included) in the background"""
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.available = os.path.isdir('/proc')
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        if self.available:
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        if self.available:
+            self.thread.join()
+
+    def run(self):
+        while True:
+            self.peak = max(self.peak, process_tree_rss(os.getpid()))
+            if self.stopped.wait(self.interval):
+                return
+
+
+class WriteCounter:
+    """Counts INSERT/UPDATE/DELETE statements sent to the database"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            with self.lock:
+                self.count += 1
+
+
+# Run in a fresh interpreter: how long importing an entry point takes and what it costs in memory
+STARTUP_PROBE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+heavy = [name for name in ('pandas', 'selenium', 'PIL', 'celery', 'openpyxl') if name in sys.modules]
+print(json.dumps({{'seconds': seconds, 'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'heavy': heavy}}))
+'''
+
+
+def measure_startup(module, workdir, runs=5):
+    """Import time and peak RSS of a new process importing module (app for web, worker for capture)"""
+    env = dict(
+        os.environ,
+        PYTHONPATH=BASE_DIR,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        CELERY_DATA_DIR=os.path.join(workdir, 'celery', 'queue'),
+        CELERY_RESULT_BACKEND=f"file://{os.path.join(workdir, 'celery', 'results')}",
+    )
+    samples = []
+    for _ in range(runs):
+        started = time.monotonic()
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE.format(module=module)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample['process_seconds'] = time.monotonic() - started
+        samples.append(sample)
+    # The first run also reads the files from disk; the median is a warm start
+    seconds = sorted(sample['seconds'] for sample in samples)
+    return {
+        'entry_point': module,
+        'import_seconds_first': round(samples[0]['seconds'], 3),
+        'import_seconds': round(seconds[len(seconds) // 2], 3),
+        'process_seconds': round(sorted(sample['process_seconds'] for sample in samples)[len(samples) // 2], 3),
+        'rss_mb': round(max(sample['rss_kb'] for sample in samples) / 1024, 1),
+        'heavy_modules': samples[-1]['heavy'],
+    }
+
+
+def run_startup(args):
+    workdir = tempfile.mkdtemp(prefix='route-benchmark-')
+    results = []
+    try:
+        for module in ('app', 'worker'):
+            result = measure_startup(module, workdir)
+            results.append(result)
+            print(
+                f"🚀 {module}.py: import {result['import_seconds']}s "
+                f"(first {result['import_seconds_first']}s, whole process {result['process_seconds']}s), "
+                f"RSS {result['rss_mb']} MB, loads {', '.join(result['heavy_modules']) or 'no heavy modules'}"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"📝 Results written to {args.json}")
+
+
+def run_job(app_module, user_id, workbook_path, engine, timeout):
+    """Queue a job and wait for it to finish; returns the finished job's row values"""
+    import uuid
+
+    A = app_module
+    job_id = str(uuid.uuid4())
+    with A.app.app_context():
+        A.db.session.add(A.Job(
+            user_id=user_id,
+            job_id=job_id,
+            filename=os.path.basename(workbook_path),
+            filepath=workbook_path,
+            render_engine=engine,
+            status='pending',
+        ))
+        A.db.session.commit()
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        with A.app.app_context():
+            job = A.Job.query.filter_by(job_id=job_id).first()
+            if job.status in ('completed', 'failed'):
+                return {column.name: getattr(job, column.name) for column in A.Job.__table__.columns}
+    raise TimeoutError(f"Job on {workbook_path} did not finish within {timeout}s")
+
+
+def format_stages(stages):
+    lines = []
+    for stage, stats in sorted(stages.items()):
+        if not stats.get('count'):
+            continue
+        lines.append(
+            f"    {stage:<14} n={stats['count']:<6} p50={stats['p50']:<8} "
+            f"p90={stats['p90']:<8} p99={stats['p99']:<8} max={stats['max']}"
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 1000, 10000],
+                        help='workbook sizes to run (default: 10 1000 10000)')
+    parser.add_argument('--engine', choices=['chrome', 'tiles'], default='chrome')
+    parser.add_argument('--render-delay', type=float, default=1.0,
+                        help='seconds before a fake route page renders (default: 1.0)')
+    parser.add_argument('--jitter', type=float, default=0.3, help='+/- seconds added to the render delay')
+    parser.add_argument('--tile-delay', type=float, default=0.05, help='seconds the fake tile request takes')
+    parser.add_argument('--consent', action='store_true', help='show a consent dialog until it is accepted')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of route pages answered with HTTP 500 (default: 0)')
+    parser.add_argument('--timeout', type=float, default=6 * 3600, help='seconds allowed per job')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    parser.add_argument('--startup', action='store_true',
+                        help='only measure import time and memory of the web (app) and worker entry points')
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.startup:
+        run_startup(args)
+        return
+
+    server, maps_url = start_fake_maps_server(
+        args.render_delay, args.jitter, args.tile_delay, args.consent, args.failure_rate
+    )
+    workdir = tempfile.mkdtemp(prefix='route-benchmark-')
+    print(f"🧪 Fake maps server at {maps_url}, working directory {workdir}")
+
+    # Point the app at the fake server and a throwaway database before it is imported;
+    # anything already set in the environment wins
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'benchmark.db')}")
+    os.environ['MAPS_BASE_URL'] = maps_url
+    os.environ.setdefault('SCREENSHOT_CACHE_MAX_MB', '0')
+    os.environ.setdefault('CHROME_PROFILE_DIR', os.path.join(workdir, 'chrome_profile'))
+    os.environ.setdefault('THUMBNAIL_DIR', os.path.join(workdir, 'thumbnails'))
+    os.environ.setdefault('TILE_DIR', os.path.join(workdir, 'tiles'))
+    os.environ.setdefault('QUEUE_POLL_INTERVAL', '0.2')
+    os.environ.setdefault('SETTLE_TIMEOUT', str(max(5.0, (args.render_delay + args.jitter) * 4)))
+    os.makedirs(os.environ['TILE_DIR'], exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, BASE_DIR)
+
+    import app as A
+    import worker
+
+    with A.app.app_context():
+        A.db.create_all()
+        A.upgrade_schema()
+        user = A.User(username='benchmark', email='benchmark@example.com', password_hash='-')
+        A.db.session.add(user)
+        A.db.session.commit()
+        user_id = user.id
+        writes = WriteCounter(A.db.engine)
+    worker.start_worker()
+
+    results = []
+    try:
+        for rows in args.rows:
+            workbook_path = os.path.join(workdir, f"benchmark_{rows}.xlsx")
+            generate_workbook(workbook_path, rows)
+
+            A.stage_timer.reset()
+            writes.count = 0
+            started = time.monotonic()
+            with PeakMemorySampler() as memory:
+                job = run_job(A, user_id, workbook_path, args.engine, args.timeout)
+            elapsed = time.monotonic() - started
+
+            result = {
+                'rows': rows,
+                'engine': args.engine,
+                'status': job['status'],
+                'completed_routes': job['completed_routes'],
+                'failed_routes': job['failed_routes'],
+                'seconds': round(elapsed, 2),
+                'routes_per_minute': round(job['completed_routes'] / elapsed * 60, 1),
+                'peak_rss_mb': round(memory.peak / 1024 / 1024, 1) if memory.available else None,
+                'db_writes': writes.count,
+                'stages': A.stage_timer.summary(),
+                'error_message': job['error_message'],
+            }
+            results.append(result)
+
+            print()
+            print(
+                f"📊 {rows} rows ({args.engine}): {result['status']}, "
+                f"{result['completed_routes']} routes in {result['seconds']}s = "
+                f"{result['routes_per_minute']} routes/min, {result['failed_routes']} failed"
+            )
+            print(f"    peak RSS {result['peak_rss_mb']} MB, {result['db_writes']} DB writes")
+            print(format_stages(result['stages']))
+            if job['error_message']:
+                print(f"    error: {job['error_message']}")
+    finally:
+        worker.worker_running = False
+        worker.driver_manager.shutdown()
+        server.shutdown()
+
+    peak_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print()
+    print(f"🏁 Benchmark done (peak RSS of the benchmark process itself: {peak_self:.1f} MB)")
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2, default=str)
+        print(f"📝 Results written to {args.json}")
+
+    os.chdir(BASE_DIR)
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Capture quality checks for Route Screenshot Generator
+Spots screenshots of a map that never drew, a loading spinner or a consent dialog, so the route can be captured again
+"""
+
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+from imaging import crop_image
+
+CHECKS = ('blank', 'grey', 'consent')
+
+# A capture this uniform is blank; an unrendered map with a spinner or a few controls on it stays above GREY_SHARE
+BLANK_SHARE = 0.999
+GREY_SHARE = 0.99
+# Shades either side of the most common colour that still count as that colour
+COLOUR_TOLERANCE = 6
+
+# A consent dialog: a bright panel over the page dimmed behind it
+DIALOG_BRIGHT = 235
+DIALOG_SCRIM = 140
+DIALOG_SHARE = (0.05, 0.7)
+
+# Captures and templates are compared as greyscale images of this size
+SIGNATURE_SIZE = (64, 36)
+TEMPLATE_DISTANCE = 12.0
+TEMPLATE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+LUMINANCE = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def load_pixels(data, crop=None, step=4):
+    """RGB pixels of an encoded image, cropped to crop, keeping every step-th row and column"""
+    image = Image.open(io.BytesIO(data))
+    if crop:
+        image = crop_image(image, crop)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    return np.asarray(image)[::step, ::step, :3]
+
+
+def dominant_share(pixels):
+    """Share of the pixels within COLOUR_TOLERANCE of the image's most common colour"""
+    levels = (pixels >> 3).astype(np.int32)  # 32 levels per channel
+    codes = (levels[..., 0] << 10) | (levels[..., 1] << 5) | levels[..., 2]
+    mode = int(np.bincount(codes.ravel(), minlength=1 << 15).argmax())
+    colour = np.array([mode >> 10, (mode >> 5) & 31, mode & 31], dtype=np.int16) * 8 + 4
+    close = np.abs(pixels.astype(np.int16) - colour).max(axis=2) <= COLOUR_TOLERANCE
+    return float(close.mean())
+
+
+def looks_like_dialog(pixels):
+    """Whether a bright panel sits on a dark, dimmed page, as a modal dialog does"""
+    luminance = pixels @ LUMINANCE
+    bright = luminance > DIALOG_BRIGHT
+    share = bright.mean()
+    if not DIALOG_SHARE[0] <= share <= DIALOG_SHARE[1]:
+        return False
+    return float(luminance[~bright].mean()) < DIALOG_SCRIM
+
+
+def signature(pixels):
+    """Small greyscale copy of an image's pixels, for comparing it with templates"""
+    small = Image.fromarray(pixels).convert('L').resize(SIGNATURE_SIZE, Image.BOX)
+    return np.asarray(small, dtype=np.float32)
+
+
+def load_templates(directory):
+    """Signatures of the images in directory, by file name without extension"""
+    templates = {}
+    if not directory or not os.path.isdir(directory):
+        return templates
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        if extension.lower() not in TEMPLATE_EXTENSIONS:
+            continue
+        try:
+            with Image.open(os.path.join(directory, name)) as image:
+                templates[stem] = signature(np.asarray(image.convert('RGB')))
+        except OSError as e:
+            print(f"⚠️ Skipping quality template {name}: {e}")
+    return templates
+
+
+# Templates are read once per process and directory
+_templates = {}
+
+
+def templates_in(directory):
+    if directory not in _templates:
+        _templates[directory] = load_templates(directory)
+    return _templates[directory]
+
+
+def assess_capture(data, crop=None, checks=CHECKS, templates=None, grey_share=GREY_SHARE):
+    """Why a screenshot looks unusable, or None if it looks like a rendered map.
+
+    data is the encoded capture; crop, if given, is the part of it that
+    ends up in the result (checked on its own so the directions panel
+    does not hide an empty map). The reasons, each enabled by its name in
+    checks:
+
+    - 'blank': the capture is a single flat colour
+    - 'grey': one colour covers at least grey_share of it, as when the
+      map tiles never loaded or only a loading spinner shows on them
+    - 'consent': a bright panel over a dimmed page, as the Google consent
+      dialog shows over the map
+
+    Each of templates ({name: signature}, see templates_in) is a known bad
+    capture; one that the capture closely resembles is reported by name.
+    """
+    pixels = load_pixels(data, crop)
+    if not pixels.size:
+        return None
+    if 'blank' in checks or 'grey' in checks:
+        share = dominant_share(pixels)
+        if 'blank' in checks and share >= BLANK_SHARE:
+            return 'blank'
+        if 'grey' in checks and share >= grey_share:
+            return 'grey'
+    if 'consent' in checks and looks_like_dialog(pixels):
+        return 'consent'
+    if templates:
+        capture = signature(pixels)
+        for name, template in templates.items():
+            if float(np.abs(capture - template).mean()) <= TEMPLATE_DISTANCE:
+                return name
+    return None
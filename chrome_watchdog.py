@@ -0,0 +1,103 @@
+"""
+Chrome memory watchdog for Route Screenshot Generator
+Decides when a long-lived Chrome session should be recycled: after a number of routes, above a memory limit or once its captures slow down
+"""
+
+import os
+import statistics
+from collections import deque
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants (Linux /proc)"""
+    children = {}
+    rss = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page_size
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, []))
+    return total
+
+
+def driver_pid(driver):
+    """PID of the chromedriver process behind a Selenium driver, or None.
+
+    Chrome and its renderers run as descendants of it, so the process tree
+    of this PID is the session's whole memory footprint.
+    """
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+class SessionWatchdog:
+    """Tracks the routes, capture latency and memory of one Chrome session.
+
+    Call record() after every capture; it returns why the session should be
+    recycled, as a (kind, detail) pair with kind 'routes', 'memory' or
+    'latency', or None while the session is fine. A limit of 0 disables
+    that check. Memory is sampled every sample_every routes since walking
+    /proc takes a few milliseconds; the latency check compares the median
+    of the last window captures with the median of the session's first
+    window captures.
+    """
+
+    def __init__(self, pid, max_routes=0, max_rss_bytes=0, slowdown_factor=0, sample_every=10, window=20):
+        self.pid = pid
+        self.max_routes = max_routes
+        self.max_rss_bytes = max_rss_bytes
+        self.slowdown_factor = slowdown_factor
+        self.sample_every = max(1, sample_every)
+        self.window = window
+        self.routes = 0
+        self.rss = None
+        self.peak_rss = 0
+        self.baseline = None
+        self.first = []
+        self.recent = deque(maxlen=window)
+
+    def sample(self):
+        """Current memory of the session's process tree in bytes, or None if unknown"""
+        if self.pid is None or not os.path.isdir('/proc'):
+            return None
+        self.rss = process_tree_rss(self.pid)
+        self.peak_rss = max(self.peak_rss, self.rss)
+        return self.rss
+
+    def record(self, seconds):
+        self.routes += 1
+        if self.baseline is None:
+            self.first.append(seconds)
+            if len(self.first) >= self.window:
+                self.baseline = statistics.median(self.first)
+        else:
+            self.recent.append(seconds)
+
+        if self.max_routes and self.routes >= self.max_routes:
+            return 'routes', f"{self.routes} routes"
+
+        if self.max_rss_bytes and self.routes % self.sample_every == 0:
+            rss = self.sample()
+            if rss is not None and rss >= self.max_rss_bytes:
+                return 'memory', f"{rss / (1024 * 1024):.0f} MB resident"
+
+        if self.slowdown_factor and self.baseline and len(self.recent) == self.window:
+            current = statistics.median(self.recent)
+            if current > self.baseline * self.slowdown_factor:
+                return 'latency', f"captures slowed from {self.baseline:.1f}s to {current:.1f}s"
+        return None
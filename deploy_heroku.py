@@ -12,7 +12,8 @@ def create_heroku_files():
     
     # Create Procfile
     with open('Procfile', 'w') as f:
-        f.write('web: gunicorn app_with_redis_alt:app\n')
+        f.write('web: gunicorn app:app\n')
+        f.write('worker: python worker.py\n')
     
     # Create runtime.txt
     with open('runtime.txt', 'w') as f:
@@ -0,0 +1,17 @@
+"""
+Gunicorn settings for Route Screenshot Generator
+Read by `gunicorn app:app` from the working directory (Docker, Heroku and manual runs)
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+
+# Each open dashboard keeps an /events stream, so requests are served by
+# threads rather than one per sync worker process
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# Streams end after EVENTS_MAX_SECONDS (20 by default), well inside this
+timeout = 30
@@ -4,9 +4,15 @@ Production-ready local hosting for Route Screenshot Generator
 """
 
 import os
+import subprocess
 import sys
 from waitress import serve
-from app_with_redis_alt import app, start_worker
+from app import app
+
+def start_capture_worker():
+    """Run the capture worker (worker.py) as a separate process next to the web server"""
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+    return subprocess.Popen([sys.executable, worker_script])
 
 def main():
     print("🚀 Starting Route Screenshot Generator (Production Mode)")
@@ -16,8 +22,12 @@ def main():
     # Set production environment
     os.environ['FLASK_ENV'] = 'production'
     
-    # Start background worker
-    start_worker()
+    # Chrome, pandas and the job workers live in their own process, so the
+    # web threads stay small and a crashing browser cannot take them down
+    worker = None
+    if os.environ.get('RUN_WORKER', '1') != '0':
+        worker = start_capture_worker()
+        print(f"🚗 Capture worker started (pid {worker.pid})")
     
     # Get host and port from environment or use defaults
     host = os.environ.get('HOST', '0.0.0.0')  # 0.0.0.0 allows external connections
@@ -34,7 +44,13 @@ def main():
     print()
     
     # Start production server
-    serve(app, host=host, port=port, threads=4)
+    try:
+        # Every open dashboard holds a thread for its /events stream
+        serve(app, host=host, port=port, threads=int(os.environ.get('WEB_THREADS', 16)))
+    finally:
+        if worker is not None:
+            worker.terminate()
+            worker.wait()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,93 @@
+"""
+Screenshot post-processing for Route Screenshot Generator
+Crops captures to the map, re-encodes them and makes thumbnails; runs in worker processes
+"""
+
+import io
+
+from PIL import Image
+
+# Output format name -> (Pillow format, file extension)
+FORMATS = {
+    'png': ('PNG', '.png'),
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+}
+
+THUMBNAIL_EXTENSION = '.thumb.jpg'
+
+
+def parse_crop(value):
+    """Parse a 'left,top,right,bottom' pixel box; an empty value means no crop"""
+    if not value:
+        return None
+    box = tuple(int(part) for part in value.split(','))
+    if len(box) != 4 or box[0] >= box[2] or box[1] >= box[3]:
+        raise ValueError(f"Invalid crop box {value!r}, expected left,top,right,bottom")
+    return box
+
+
+def crop_image(image, crop):
+    """Crop a PIL image to a left,top,right,bottom box clamped to the image"""
+    left, top, right, bottom = crop
+    return image.crop((
+        min(left, image.width - 1), min(top, image.height - 1),
+        min(right, image.width), min(bottom, image.height),
+    ))
+
+
+def extension_for(output_format):
+    if output_format not in FORMATS:
+        raise ValueError(f"Unsupported image format {output_format!r}, expected one of {', '.join(FORMATS)}")
+    return FORMATS[output_format][1]
+
+
+def encode(image, output_format, quality):
+    pillow_format = FORMATS[output_format][0]
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    options = {'quality': quality} if pillow_format in ('JPEG', 'WEBP') else {}
+    buffer = io.BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def make_thumbnail(image, width):
+    """JPEG thumbnail of an image (a PIL image or encoded bytes), width pixels wide"""
+    if isinstance(image, bytes):
+        image = Image.open(io.BytesIO(image))
+    thumbnail = image.convert('RGB')
+    height = max(1, round(thumbnail.height * width / thumbnail.width))
+    thumbnail.thumbnail((width, height))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, 'JPEG', quality=70)
+    return buffer.getvalue()
+
+
+def needs_processing(output_format='png', quality=80, crop=None, thumbnail_width=0, source_format='png'):
+    """Whether process_screenshot would do anything with these options"""
+    return bool(crop or thumbnail_width or output_format != source_format)
+
+
+def process_screenshot(data, output_format='png', quality=80, crop=None, thumbnail_width=0, source_format='png'):
+    """Post-process a screenshot encoded as source_format.
+
+    Crops to crop (clamped to the image), re-encodes to output_format and
+    makes a thumbnail if thumbnail_width is set. An uncropped image already
+    in output_format is passed through without re-encoding. Returns
+    (image_bytes, thumbnail_bytes or None).
+    """
+    if not needs_processing(output_format, quality, crop, thumbnail_width, source_format):
+        return data, None
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+
+    if crop:
+        image = crop_image(image, crop)
+
+    if crop or output_format != source_format:
+        data = encode(image, output_format, quality)
+
+    thumbnail = make_thumbnail(image, thumbnail_width) if thumbnail_width else None
+    return data, thumbnail
@@ -0,0 +1,263 @@
+"""
+Route file ingest for Route Screenshot Generator
+Validates sheet names and headers first, then streams rows lazily in chunks
+"""
+
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Columns each sheet must provide; Region only has to exist
+REQUIRED_SHEETS = {
+    'Transportation': ['ID', 'latitude', 'longitude', 'warehouse'],
+    'Warehouse': ['Warehouse', 'latitude', 'longitude'],
+    'Region': [],
+}
+
+
+# CSV and Parquet uploads are one flat table: a Transportation row per route
+# carrying its warehouse's coordinates, from which the Warehouse sheet is derived
+FLAT_COLUMNS = ['ID', 'latitude', 'longitude', 'warehouse', 'warehouse_latitude', 'warehouse_longitude']
+FLAT_WAREHOUSE_COLUMNS = {
+    'warehouse': 'Warehouse', 'warehouse_latitude': 'latitude', 'warehouse_longitude': 'longitude',
+}
+
+
+class RouteReader:
+    """Common interface of the readers: open with `with`, then read sheets by name"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def __enter__(self):
+        self.open()
+        try:
+            self.validate()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def count_rows(self, sheet_name, chunk_size=5000):
+        """Exact number of non-blank data rows (reads the whole sheet)"""
+        return sum(len(chunk) for chunk in self.iter_chunks(sheet_name, chunk_size))
+
+
+class WorkbookReader(RouteReader):
+    """Read-only view of an uploaded workbook.
+
+    Opening the reader checks that the required sheets and header columns
+    are present without loading any data rows. Rows are then read on demand,
+    only for the columns the pipeline uses, so memory stays flat however
+    large the workbook or its unused sheets are.
+    """
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self.workbook = None
+        self.headers = {}
+
+    def open(self):
+        self.workbook = load_workbook(self.filepath, read_only=True, data_only=True)
+
+    def close(self):
+        if self.workbook is not None:
+            self.workbook.close()
+            self.workbook = None
+
+    def validate(self):
+        """Check sheet names and header rows; raise ValueError on the first problem"""
+        for sheet_name, columns in REQUIRED_SHEETS.items():
+            if sheet_name not in self.workbook.sheetnames:
+                raise ValueError(f"Missing required sheet: {sheet_name}")
+            if not columns:
+                continue
+
+            header_row = next(
+                self.workbook[sheet_name].iter_rows(min_row=1, max_row=1, values_only=True), ()
+            )
+            header = {}
+            for position, value in enumerate(header_row):
+                if value is not None:
+                    header.setdefault(str(value), position)
+
+            missing = [column for column in columns if column not in header]
+            if missing:
+                raise ValueError(
+                    f"Sheet {sheet_name} is missing required columns: {', '.join(missing)}"
+                )
+            self.headers[sheet_name] = {column: header[column] for column in columns}
+
+    def row_count(self, sheet_name):
+        """Data rows in a sheet according to its stored dimensions (may overcount blank rows)"""
+        max_row = self.workbook[sheet_name].max_row
+        return max(0, max_row - 1) if max_row else None
+
+    def iter_chunks(self, sheet_name, chunk_size=1000):
+        """Yield DataFrames of up to chunk_size rows holding only the required columns.
+
+        The DataFrame index is the row's position in the sheet (0 = first data
+        row), matching what pd.read_excel would have produced.
+        """
+        columns = self.headers[sheet_name]
+        names = list(columns)
+        positions = [columns[name] for name in names]
+
+        records = []
+        index = []
+        rows = self.workbook[sheet_name].iter_rows(min_row=2, values_only=True)
+        for position, row in enumerate(rows):
+            values = [row[i] if i < len(row) else None for i in positions]
+            if all(value is None for value in values):
+                continue
+            records.append(values)
+            index.append(position)
+            if len(records) >= chunk_size:
+                yield pd.DataFrame(records, columns=names, index=index)
+                records = []
+                index = []
+        if records:
+            yield pd.DataFrame(records, columns=names, index=index)
+
+    def read_sheet(self, sheet_name):
+        """Read the required columns of a (small) sheet into one DataFrame"""
+        chunks = list(self.iter_chunks(sheet_name))
+        if not chunks:
+            return pd.DataFrame(columns=list(self.headers[sheet_name]))
+        return pd.concat(chunks)
+
+
+class FlatRouteReader(RouteReader):
+    """A CSV or Parquet route table presented as the workbook's sheets.
+
+    'Transportation' is the table itself and 'Warehouse' is built from the
+    distinct warehouse columns (the first coordinates seen for a name win).
+    The Region sheet has no counterpart and is not needed for capturing.
+    """
+
+    def validate(self):
+        names = [str(name) for name in self.column_names()]
+        missing = [column for column in FLAT_COLUMNS if column not in names]
+        if missing:
+            raise ValueError(f"Route file is missing required columns: {', '.join(missing)}")
+
+    def iter_chunks(self, sheet_name, chunk_size=1000):
+        """Yield DataFrames of up to chunk_size rows, indexed by row position like WorkbookReader"""
+        if sheet_name != 'Transportation':
+            raise ValueError(f"Route files only have Transportation rows, not {sheet_name}")
+        columns = FLAT_COLUMNS[:4]
+        for frame in self.iter_frames(columns, chunk_size):
+            yield frame.dropna(how='all')
+
+    def read_sheet(self, sheet_name):
+        if sheet_name == 'Transportation':
+            chunks = list(self.iter_chunks(sheet_name))
+            return pd.concat(chunks) if chunks else pd.DataFrame(columns=FLAT_COLUMNS[:4])
+        if sheet_name != 'Warehouse':
+            raise ValueError(f"Route files have no {sheet_name} sheet")
+        columns = list(FLAT_WAREHOUSE_COLUMNS)
+        chunks = [
+            frame.dropna(subset=['warehouse']).drop_duplicates('warehouse')
+            for frame in self.iter_frames(columns, 50000)
+        ]
+        if not chunks:
+            return pd.DataFrame(columns=list(FLAT_WAREHOUSE_COLUMNS.values()))
+        warehouses = pd.concat(chunks).drop_duplicates('warehouse', keep='first')
+        return warehouses.rename(columns=FLAT_WAREHOUSE_COLUMNS).reset_index(drop=True)
+
+
+class CsvRouteReader(FlatRouteReader):
+    """Route table in a CSV file with a header row"""
+
+    # Keep site IDs and warehouse names as written (e.g. leading zeros)
+    DTYPES = {'ID': str, 'warehouse': str}
+
+    def column_names(self):
+        return list(pd.read_csv(self.filepath, nrows=0).columns)
+
+    def iter_frames(self, columns, chunk_size):
+        dtypes = {column: dtype for column, dtype in self.DTYPES.items() if column in columns}
+        reader = pd.read_csv(self.filepath, usecols=columns, dtype=dtypes, chunksize=chunk_size)
+        with reader:
+            for frame in reader:
+                yield frame[columns]
+
+    def row_count(self, sheet_name):
+        """Lines after the header (may overcount quoted line breaks and blank lines)"""
+        lines = 0
+        last = b''
+        with open(self.filepath, 'rb') as source:
+            for block in iter(lambda: source.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+        if last and last != b'\n':
+            lines += 1  # the last line has no line break
+        return max(0, lines - 1)
+
+
+class ParquetRouteReader(FlatRouteReader):
+    """Route table in a Parquet file, read in record batches (needs pyarrow)"""
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self.source = None
+        self.parquet = None
+
+    def open(self):
+        # Imported here so the app does not load pyarrow unless a Parquet file comes in
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet files need the pyarrow package, which is not installed")
+        self.source = open(self.filepath, 'rb')
+        try:
+            self.parquet = pq.ParquetFile(self.source)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        self.parquet = None
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+
+    def column_names(self):
+        return self.parquet.schema_arrow.names
+
+    def iter_frames(self, columns, chunk_size):
+        position = 0
+        for batch in self.parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            frame = batch.to_pandas()
+            frame.index = pd.RangeIndex(position, position + len(frame))
+            position += len(frame)
+            yield frame
+
+    def row_count(self, sheet_name):
+        return self.parquet.metadata.num_rows
+
+
+# Upload extension -> reader
+READERS = {
+    '.xlsx': WorkbookReader,
+    '.csv': CsvRouteReader,
+    '.parquet': ParquetRouteReader,
+}
+
+
+def route_reader(filepath):
+    """Reader for a route file, chosen by its extension; use it with `with`"""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension not in READERS:
+        raise ValueError(f"Unsupported file type {extension!r}, expected one of {', '.join(READERS)}")
+    return READERS[extension](filepath)
@@ -0,0 +1,95 @@
+"""
+Prometheus metrics for Route Screenshot Generator
+Stage latencies, route outcomes, Chrome sessions and queue depth, exported on /metrics
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+    start_http_server,
+)
+from prometheus_client import multiprocess
+
+# From cache lookups (milliseconds) to settling a slow route or loading a big workbook (minutes)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+stage_seconds = Histogram(
+    'route_stage_seconds', 'Time spent in each stage of the capture pipeline',
+    ['stage'], buckets=STAGE_BUCKETS,
+)
+routes_total = Counter(
+    'routes_processed_total', 'Routes finished, by outcome (captured, cached, failed)', ['outcome'],
+)
+jobs_total = Counter('jobs_finished_total', 'Jobs finished, by final status', ['status'])
+chrome_launches_total = Counter('chrome_launches_total', 'Chrome sessions launched')
+navigations_total = Counter(
+    'route_navigations_total',
+    'Routes opened in Chrome, by how (inpage, reload, or fallback: reloaded after an in-page attempt)',
+    ['mode'],
+)
+chrome_restarts_total = Counter(
+    'chrome_restarts_total', 'Chrome sessions discarded after a crash or a failed health check',
+)
+chrome_recycles_total = Counter(
+    'chrome_recycles_total', 'Healthy Chrome sessions replaced by the watchdog, by reason (routes, memory, latency)',
+    ['reason'],
+)
+chrome_session_rss_bytes = Histogram(
+    'chrome_session_rss_bytes', 'Memory of a Chrome session process tree, sampled while it captures',
+    buckets=tuple(megabytes * 1024 * 1024 for megabytes in (128, 256, 384, 512, 768, 1024, 1536, 2048, 3072, 4096)),
+)
+capture_issues_total = Counter(
+    'capture_quality_issues_total',
+    'Chrome captures that failed the quality checks, by reason (blank, grey, consent or a template name)',
+    ['reason'],
+)
+active_drivers = Gauge(
+    'chrome_drivers_active', 'Chrome sessions capturing routes', multiprocess_mode='livesum',
+)
+warm_drivers = Gauge(
+    'chrome_drivers_warm', 'Idle Chrome sessions kept open between jobs', multiprocess_mode='livesum',
+)
+job_routes_per_second = Gauge(
+    'job_routes_per_second', 'Routes finished per second by each running job, since it started',
+    ['job_id'], multiprocess_mode='livesum',
+)
+jobs_by_status = Gauge(
+    'jobs', 'Jobs in the database, by status (pending is the queue depth)',
+    ['status'], multiprocess_mode='livemax',
+)
+
+
+def set_job_rate(job_id, routes_per_second):
+    job_routes_per_second.labels(str(job_id)).set(routes_per_second)
+
+
+def clear_job_rate(job_id):
+    # Zeroed first: in multiprocess mode remove() leaves the last value in the shared files
+    job_routes_per_second.labels(str(job_id)).set(0)
+    job_routes_per_second.remove(str(job_id))
+
+
+def collecting_registry():
+    """Registry to export from.
+
+    With PROMETHEUS_MULTIPROC_DIR set (needed under gunicorn with several
+    workers, or to combine the web app with python worker.py) the values of
+    every process are read from that directory and combined; otherwise this
+    process's registry is exported.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics():
+    """Body and content type of a /metrics response"""
+    return generate_latest(collecting_registry()), CONTENT_TYPE_LATEST
+
+
+def serve(port):
+    """Export metrics over HTTP on port from a process that serves no web pages (the capture worker)"""
+    start_http_server(port, registry=collecting_registry())
@@ -0,0 +1,203 @@
+"""
+Route planning for Route Screenshot Generator
+Joins Transportation rows to their warehouse once, builds every route URL up front and orders routes by locality
+"""
+
+import pandas as pd
+
+GOOGLE_MAPS_URL = 'https://www.google.com/maps'
+
+TRANSPORTATION_COLUMNS = ['ID', 'latitude', 'longitude', 'warehouse']
+WAREHOUSE_COLUMNS = ['Warehouse', 'latitude', 'longitude']
+
+
+class RoutePlan:
+    """Routes ready for capture plus the rows that were left out"""
+
+    def __init__(self, routes, unmatched_warehouses, invalid_rows, total_rows):
+        self.routes = routes
+        self.unmatched_warehouses = unmatched_warehouses  # warehouse name -> row count
+        self.invalid_rows = invalid_rows  # site IDs with missing/out-of-range coordinates
+        self.total_rows = total_rows
+
+    def absorb_skipped(self, other):
+        """Add the skipped rows of another plan (e.g. a later chunk) to this one"""
+        for name, count in other.unmatched_warehouses.items():
+            self.unmatched_warehouses[name] = self.unmatched_warehouses.get(name, 0) + count
+        self.invalid_rows.extend(other.invalid_rows)
+        self.total_rows += other.total_rows
+
+    @property
+    def skipped_count(self):
+        return sum(self.unmatched_warehouses.values()) + len(self.invalid_rows)
+
+    @property
+    def route_count(self):
+        """Rows that make a route (len(routes) unless the routes were dropped)"""
+        return self.total_rows - self.skipped_count
+
+    def describe_skipped(self, limit=10):
+        """Human readable summary of skipped rows, or None if nothing was skipped"""
+        parts = []
+        if self.unmatched_warehouses:
+            names = ', '.join(
+                f"{name} ({count})" for name, count in list(self.unmatched_warehouses.items())[:limit]
+            )
+            more = len(self.unmatched_warehouses) - limit
+            if more > 0:
+                names += f" and {more} more"
+            parts.append(
+                f"{sum(self.unmatched_warehouses.values())} rows reference warehouses "
+                f"missing from the Warehouse sheet: {names}"
+            )
+        if self.invalid_rows:
+            ids = ', '.join(str(site_id) for site_id in self.invalid_rows[:limit])
+            more = len(self.invalid_rows) - limit
+            if more > 0:
+                ids += f" and {more} more"
+            parts.append(f"{len(self.invalid_rows)} rows have invalid coordinates: {ids}")
+        return '; '.join(parts) if parts else None
+
+
+def require_columns(df, columns, sheet_name):
+    """Raise ValueError if any of columns is missing from df"""
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"Sheet {sheet_name} is missing required columns: {', '.join(missing)}")
+
+
+def valid_coordinates(lat, lng):
+    """Boolean mask of rows whose coordinates are numbers within range"""
+    return lat.between(-90, 90) & lng.between(-180, 180)
+
+
+def index_warehouses(warehouse_df):
+    """Warehouse coordinates indexed by name (the first row wins on duplicates)"""
+    require_columns(warehouse_df, WAREHOUSE_COLUMNS, 'Warehouse')
+    return (
+        warehouse_df[WAREHOUSE_COLUMNS]
+        .drop_duplicates('Warehouse', keep='first')
+        .set_index('Warehouse')
+        .rename(columns={'latitude': 'warehouse_lat', 'longitude': 'warehouse_lng'})
+    )
+
+
+def plan_routes(transportation_df, warehouse_df, maps_url=GOOGLE_MAPS_URL):
+    """Build the capture plan for a workbook.
+
+    Every Transportation row is joined to its warehouse through a hash index
+    on the warehouse name, coordinates are validated in bulk and the
+    directions URLs are built as whole columns. Rows that cannot be captured
+    are reported on the plan rather than skipped silently.
+    """
+    return plan_chunk(transportation_df, index_warehouses(warehouse_df), maps_url)
+
+
+def iter_route_plans(transportation_chunks, warehouse_df, maps_url=GOOGLE_MAPS_URL):
+    """Plan a stream of Transportation chunks against one warehouse index"""
+    warehouses = index_warehouses(warehouse_df)
+    for chunk in transportation_chunks:
+        yield plan_chunk(chunk, warehouses, maps_url)
+
+
+def check_routes(transportation_chunks, warehouse_df, maps_url=GOOGLE_MAPS_URL):
+    """Plan a whole Transportation sheet chunk by chunk, keeping only what was skipped.
+
+    Used at upload, so unmatched warehouses and invalid coordinates are
+    known before the job is queued without holding every route in memory.
+    The returned plan has no routes; see its route_count.
+    """
+    summary = RoutePlan([], {}, [], 0)
+    for plan in iter_route_plans(transportation_chunks, warehouse_df, maps_url):
+        summary.absorb_skipped(plan)
+    return summary
+
+
+def plan_chunk(transportation_df, warehouses, maps_url=GOOGLE_MAPS_URL):
+    """Plan the rows of one Transportation DataFrame.
+
+    A route's index is its row's index label, i.e. its position in the sheet.
+    """
+    require_columns(transportation_df, TRANSPORTATION_COLUMNS, 'Transportation')
+
+    sites = transportation_df[TRANSPORTATION_COLUMNS].copy()
+    sites['index'] = sites.index
+    plan = sites.join(warehouses, on='warehouse')
+
+    matched = plan['warehouse'].isin(warehouses.index)
+    unmatched_warehouses = (
+        plan.loc[~matched, 'warehouse'].fillna('(blank)').astype(str).value_counts().to_dict()
+    )
+    plan = plan[matched].copy()
+
+    for column in ('latitude', 'longitude', 'warehouse_lat', 'warehouse_lng'):
+        plan[column] = pd.to_numeric(plan[column], errors='coerce')
+    valid = (
+        valid_coordinates(plan['latitude'], plan['longitude'])
+        & valid_coordinates(plan['warehouse_lat'], plan['warehouse_lng'])
+    )
+    invalid_rows = plan.loc[~valid, 'ID'].tolist()
+    plan = plan[valid].copy()
+
+    # Generate Google Maps URLs (latitude,longitude format)
+    plan['url'] = (
+        f"{maps_url}/dir/"
+        + plan['warehouse_lat'].astype(str) + ',' + plan['warehouse_lng'].astype(str) + '/'
+        + plan['latitude'].astype(str) + ',' + plan['longitude'].astype(str)
+    )
+
+    routes = plan.rename(columns={'ID': 'site_id'})[
+        ['index', 'site_id', 'warehouse', 'warehouse_lat', 'warehouse_lng', 'latitude', 'longitude', 'url']
+    ].to_dict('records')
+
+    return RoutePlan(routes, unmatched_warehouses, invalid_rows, len(sites))
+
+
+def hilbert_index(lat, lng, order=16):
+    """Position of a point along a Hilbert curve laid over the globe.
+
+    Points close on the map get close positions, so sorting by it walks an
+    area before moving on. order 16 is a 65536 x 65536 grid (cells of
+    about 600 m by 300 m at the equator).
+    """
+    side = 1 << order
+    x = min(side - 1, max(0, int((float(lng) + 180.0) / 360.0 * side)))
+    y = min(side - 1, max(0, int((float(lat) + 90.0) / 180.0 * side)))
+    index = 0
+    step = side >> 1
+    while step > 0:
+        rx = 1 if x & step else 0
+        ry = 1 if y & step else 0
+        index += step * step * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        if ry == 0:
+            if rx == 1:
+                x, y = side - 1 - x, side - 1 - y
+            x, y = y, x
+        step >>= 1
+    return index
+
+
+def order_by_locality(routes):
+    """Routes grouped by warehouse and, within a warehouse, by where the site lies.
+
+    Consecutive routes then share an origin and show neighbouring areas, so
+    the browser (or the tile renderer) already has most of the map. Routes
+    keep their index and site ID, so checkpoints and file names are the same
+    as in sheet order.
+    """
+    return sorted(
+        routes,
+        key=lambda route: (str(route['warehouse']), hilbert_index(route['latitude'], route['longitude'])),
+    )
+
+
+def iter_by_locality(routes, window):
+    """Reorder a stream of routes by locality, window routes at a time to bound memory"""
+    batch = []
+    for route in routes:
+        batch.append(route)
+        if len(batch) >= window:
+            yield from order_by_locality(batch)
+            batch = []
+    yield from order_by_locality(batch)
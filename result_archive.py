@@ -0,0 +1,152 @@
+"""
+Result archives for Route Screenshot Generator
+Screenshots are appended to the job's ZIP as they are produced and can be streamed while the job runs
+"""
+
+import io
+import os
+import struct
+import threading
+import zipfile
+import zlib
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+class ResultArchive:
+    """A job's result ZIP, appended to one screenshot at a time.
+
+    Entries are stored, not deflated (PNG/JPEG/WebP data does not compress),
+    and each one is written complete, with its sizes in the local header,
+    and flushed before add_bytes() returns. That lets iter_archive_entries() read
+    the finished entries of an archive that is still being written, from
+    this process or any other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            self.zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        elif zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path, 'a', compression=zipfile.ZIP_STORED)
+        else:
+            # Left unfinished by a crashed worker (no central directory). Mode
+            # 'a' would silently start a second archive after the old data.
+            self.zip = self._recover(path)
+        self.names = set(self.zip.namelist())
+
+    @staticmethod
+    def _recover(path):
+        """Rewrite an unfinished archive keeping its complete entries, so a resumed job keeps them"""
+        partial = f"{path}.partial"
+        os.replace(path, partial)
+        recovered = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        for name, data in iter_archive_entries(partial):
+            if name not in recovered.NameToInfo:
+                recovered.writestr(name, data)
+        recovered.fp.flush()
+        os.remove(partial)
+        return recovered
+
+    def __contains__(self, name):
+        with self.lock:
+            return name in self.names
+
+    def __len__(self):
+        with self.lock:
+            return len(self.names)
+
+    def add_bytes(self, data, name):
+        """Append an entry; returns False if the archive already has one by that name"""
+        with self.lock:
+            if name in self.names:
+                return False
+            self.zip.writestr(name, data)
+            self.zip.fp.flush()
+            self.names.add(name)
+            return True
+
+    def add_file(self, source_path, name):
+        """Append the contents of a file (read whole, so the entry is written in one go)"""
+        with open(source_path, 'rb') as source:
+            data = source.read()
+        return self.add_bytes(data, name)
+
+    def close(self):
+        """Write the central directory; the archive is a complete ZIP afterwards"""
+        with self.lock:
+            if self.zip is not None:
+                self.zip.close()
+                self.zip = None
+
+    def abandon(self):
+        """Close the file without finishing it, e.g. when another worker took the job over"""
+        with self.lock:
+            if self.zip is not None:
+                # Detach the file first so zipfile never writes a central directory
+                fp, self.zip.fp = self.zip.fp, None
+                fp.close()
+                self.zip = None
+
+
+def iter_archive_entries(path):
+    """Yield (name, data) for every complete stored entry of a ZIP, even one still being written.
+
+    Local headers are walked from the start of the file, so the central
+    directory is not needed. The walk stops at the first entry that is not
+    complete yet (zeroed header, short read or CRC mismatch) or at the
+    central directory. Empty entries are never written by ResultArchive.
+    """
+    with open(path, 'rb') as archive:
+        while True:
+            header = archive.read(LOCAL_HEADER.size)
+            if len(header) < LOCAL_HEADER.size:
+                return
+            (signature, _, flags, method, _, _, crc, compressed_size, _,
+             name_length, extra_length) = LOCAL_HEADER.unpack(header)
+            if signature != LOCAL_HEADER_SIGNATURE or method != zipfile.ZIP_STORED or flags & 0x08:
+                return
+            if compressed_size == 0:
+                # zipfile writes a zeroed header first and patches it once the data is out
+                return
+
+            raw_name = archive.read(name_length)
+            archive.seek(extra_length, os.SEEK_CUR)
+            data = archive.read(compressed_size)
+            if len(raw_name) < name_length or len(data) < compressed_size:
+                return
+            if zlib.crc32(data) & 0xFFFFFFFF != crc:
+                return
+            yield raw_name.decode('utf-8' if flags & 0x800 else 'cp437'), data
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable sink that collects what zipfile writes so it can be yielded"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """Generate a stored ZIP on the fly from (name, data) pairs"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as output:
+        for name, data in entries:
+            output.writestr(name, data)
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,176 @@
+"""
+Content-addressed screenshot cache for Route Screenshot Generator
+Reuses captures of unchanged routes across jobs, bounded by a TTL and a disk budget
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+def link_or_copy(source, destination):
+    """Hard-link source to destination, copying when linking is not possible"""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ScreenshotCache:
+    """On-disk cache of route screenshots keyed by what determines the image.
+
+    Entries live under root/<2 hex chars>/<sha256><ext>. An entry's mtime is
+    when it was captured (for the TTL) and its atime is refreshed on every
+    hit (for LRU eviction), so no separate index has to be kept in sync.
+    """
+
+    def __init__(self, root, max_bytes, ttl_seconds):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.size = None  # bytes on disk, computed on first store
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(origin, destination, viewport, settings):
+        """Cache key for a route capture.
+
+        origin and destination are (lat, lng) pairs, rounded to 6 decimals
+        (~0.1 m) so float noise from the workbook does not defeat the cache.
+        """
+        material = {
+            'origin': [round(float(value), 6) for value in origin],
+            'destination': [round(float(value), 6) for value in destination],
+            'viewport': viewport,
+            'settings': settings,
+        }
+        encoded = json.dumps(material, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def path_for(self, key, extension='.png'):
+        return os.path.join(self.root, key[:2], key + extension)
+
+    def lookup(self, key, extension='.png'):
+        """Return the path of a fresh cached entry, or None"""
+        if not self.enabled:
+            return None
+        path = self.path_for(key, extension)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        now = time.time()
+        if now - stat.st_mtime > self.ttl_seconds:
+            self._remove(path, stat.st_size)
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # Record the access for LRU eviction without touching the capture time
+        try:
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, source, extension='.png'):
+        """Add a freshly captured file to the cache, evicting old entries if needed"""
+        if not self.enabled:
+            return
+        path = self.path_for(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Link/copy under a temporary name and rename so readers never see a partial file
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        link_or_copy(source, temporary)
+        os.replace(temporary, path)
+        self._added(path)
+
+    def store_bytes(self, key, data, extension='.png'):
+        """Add an image held in memory to the cache"""
+        if not self.enabled:
+            return
+        path = self.path_for(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, 'wb') as output:
+            output.write(data)
+        os.replace(temporary, path)
+        self._added(path)
+
+    def _added(self, path):
+        added = os.path.getsize(path)
+        with self.lock:
+            if self.size is None:
+                self.size = self._disk_usage()
+            else:
+                self.size += added
+            over_budget = self.size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under budget"""
+        now = time.time()
+        entries = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl_seconds:
+                    self._remove(path, stat.st_size)
+                else:
+                    entries.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path, size)
+            total -= size
+
+        with self.lock:
+            self.size = total
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            if self.size is not None:
+                self.size -= size
+
+    def _disk_usage(self):
+        total = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(directory, filename))
+                except FileNotFoundError:
+                    pass
+        return total
@@ -0,0 +1,131 @@
+"""
+Browser-free route renderer for Route Screenshot Generator
+Composes route maps from a local slippy-map tile directory instead of loading Google Maps in Chrome
+"""
+
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw
+
+from imaging import encode, make_thumbnail
+
+TILE_SIZE = 256
+MISSING_TILE_COLOR = (229, 227, 223)
+ROUTE_COLOR = (26, 115, 232)
+WAREHOUSE_COLOR = (52, 168, 83)
+SITE_COLOR = (234, 67, 53)
+
+
+def lat_lng_to_pixel(lat, lng, zoom):
+    """Web Mercator world pixel coordinates of a point at a zoom level"""
+    world = TILE_SIZE * (2 ** zoom)
+    x = (lng + 180.0) / 360.0 * world
+    sin_lat = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * world
+    return x, y
+
+
+def fit_zoom(points, width, height, padding, max_zoom):
+    """Highest zoom level at which all points fit in width x height with padding around them"""
+    for zoom in range(max_zoom, -1, -1):
+        pixels = [lat_lng_to_pixel(lat, lng, zoom) for lat, lng in points]
+        span_x = max(x for x, _ in pixels) - min(x for x, _ in pixels)
+        span_y = max(y for _, y in pixels) - min(y for _, y in pixels)
+        if span_x <= width - 2 * padding and span_y <= height - 2 * padding:
+            return zoom
+    return 0
+
+
+class TileSource:
+    """Tiles read from root/{z}/{x}/{y}.png, with the most recently used ones kept decoded in memory"""
+
+    def __init__(self, root, max_tiles=256):
+        self.root = root
+        self.max_tiles = max_tiles
+        self.lock = threading.Lock()
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.missing = 0
+
+    def get(self, zoom, x, y):
+        count = 2 ** zoom
+        x %= count  # wrap around the antimeridian
+        if not 0 <= y < count:
+            return None
+        key = (zoom, x, y)
+        with self.lock:
+            if key in self.tiles:
+                # Missing tiles are remembered too (as None)
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return self.tiles[key]
+            self.misses += 1
+
+        tile = self.load(zoom, x, y)
+        with self.lock:
+            self.tiles[key] = tile
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return tile
+
+    def load(self, zoom, x, y):
+        path = os.path.join(self.root, str(zoom), str(x), f"{y}.png")
+        try:
+            with Image.open(path) as tile:
+                return tile.convert('RGB')
+        except OSError:
+            self.missing += 1
+            return None
+
+
+def render_map(tiles, origin, destination, width, height, padding=80, max_zoom=17):
+    """Map of width x height pixels showing origin and destination joined by a straight route"""
+    zoom = fit_zoom([origin, destination], width, height, padding, max_zoom)
+    origin_px = lat_lng_to_pixel(*origin, zoom)
+    destination_px = lat_lng_to_pixel(*destination, zoom)
+    left = int((origin_px[0] + destination_px[0]) / 2 - width / 2)
+    top = int((origin_px[1] + destination_px[1]) / 2 - height / 2)
+
+    canvas = Image.new('RGB', (width, height), MISSING_TILE_COLOR)
+    for tile_x in range(left // TILE_SIZE, (left + width - 1) // TILE_SIZE + 1):
+        for tile_y in range(top // TILE_SIZE, (top + height - 1) // TILE_SIZE + 1):
+            tile = tiles.get(zoom, tile_x, tile_y)
+            if tile is not None:
+                canvas.paste(tile, (tile_x * TILE_SIZE - left, tile_y * TILE_SIZE - top))
+
+    draw = ImageDraw.Draw(canvas)
+    start = (origin_px[0] - left, origin_px[1] - top)
+    end = (destination_px[0] - left, destination_px[1] - top)
+    draw.line([start, end], fill=ROUTE_COLOR, width=6)
+    for (x, y), color in ((start, WAREHOUSE_COLOR), (end, SITE_COLOR)):
+        draw.ellipse((x - 11, y - 11, x + 11, y + 11), fill=color, outline='white', width=3)
+    return canvas
+
+
+# One tile source per process (the image pool runs renders in worker processes)
+_tile_source = None
+
+
+def tile_source(root, max_tiles):
+    global _tile_source
+    if _tile_source is None or _tile_source.root != root:
+        _tile_source = TileSource(root, max_tiles)
+    return _tile_source
+
+
+def render_route(route, tile_dir, max_tiles=256, width=1488, height=1080, max_zoom=17,
+                 output_format='png', quality=80, thumbnail_width=0):
+    """Render a planned route; returns (image_bytes, thumbnail_bytes or None)"""
+    image = render_map(
+        tile_source(tile_dir, max_tiles),
+        (float(route['warehouse_lat']), float(route['warehouse_lng'])),
+        (float(route['latitude']), float(route['longitude'])),
+        width, height, max_zoom=max_zoom,
+    )
+    data = encode(image, output_format, quality)
+    thumbnail = make_thumbnail(image, thumbnail_width) if thumbnail_width else None
+    return data, thumbnail
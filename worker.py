@@ -0,0 +1,1873 @@
+#!/usr/bin/env python3
+"""
+Capture worker for Route Screenshot Generator
+Claims queued jobs from the database and captures their routes; also the Celery app capture nodes run
+
+The web app (app.py, served by gunicorn or waitress) only queues jobs and
+reports on them, so Selenium, pandas and Pillow are loaded here and not in
+every web process. Run `python worker.py` next to it; with
+CAPTURE_BACKEND=celery, capture nodes run `celery -A worker.celery worker`.
+"""
+
+import os
+import atexit
+import base64
+import heapq
+import itertools
+import json
+import shutil
+import signal
+import socket
+import uuid
+import threading
+import time
+import queue
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from celery import Celery, states
+from celery.signals import worker_init, worker_ready
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from sqlalchemy import and_, func, or_
+import metrics
+from app import (
+    app, db, Job, progress_tracker, stage_timer, summarize_durations, upgrade_schema,
+    load_route_checkpoints, priority_weight, RENDER_ENGINES,
+)
+from capture_quality import assess_capture, templates_in
+from chrome_watchdog import SessionWatchdog, driver_pid
+from imaging import (
+    THUMBNAIL_EXTENSION, extension_for, make_thumbnail, needs_processing, parse_crop, process_screenshot,
+)
+from ingest import route_reader
+from planning import GOOGLE_MAPS_URL, RoutePlan, iter_by_locality, iter_route_plans
+from result_archive import ResultArchive
+from screenshot_cache import ScreenshotCache
+from tile_renderer import render_route
+
+def make_celery():
+    """Celery app for route capture tasks.
+    
+    Without a broker configured it falls back to a filesystem broker and
+    result store under instance/celery, which is enough to run capture
+    workers next to the app on one machine. Their directories are only
+    created once the celery backend is used (prepare_celery_storage).
+    """
+    broker = app.config['CELERY_BROKER_URL']
+    backend = app.config['CELERY_RESULT_BACKEND']
+    celery_app = Celery('app', broker=broker, backend=backend)
+    celery_app.conf.update(
+        task_acks_late=True,  # a task lost with its worker is delivered again
+        worker_prefetch_multiplier=1,  # captures are slow, don't let one worker hoard them
+        result_expires=24 * 3600,
+        broker_connection_retry_on_startup=True,
+    )
+    if broker.startswith('filesystem://'):
+        celery_app.conf.broker_transport_options = {
+            'data_folder_in': app.config['CELERY_DATA_DIR'],
+            'data_folder_out': app.config['CELERY_DATA_DIR'],
+            'control_folder': os.path.join(app.config['CELERY_DATA_DIR'], 'control'),
+            'polling_interval': 0.1,
+        }
+        # Its worker loop only fetches again every 2 seconds once the prefetch
+        # limit is reached, so take bigger batches than with a real broker
+        celery_app.conf.worker_prefetch_multiplier = 8
+    return celery_app
+
+def prepare_celery_storage():
+    """Create the directories of the filesystem broker and result store, where those are configured"""
+    if app.config['CELERY_BROKER_URL'].startswith('filesystem://'):
+        os.makedirs(os.path.join(app.config['CELERY_DATA_DIR'], 'control'), exist_ok=True)
+    backend = app.config['CELERY_RESULT_BACKEND']
+    if backend.startswith('file://'):
+        os.makedirs(backend[len('file://'):], exist_ok=True)
+
+celery = make_celery()
+
+@worker_init.connect
+def prepare_capture_node(**kwargs):
+    """A capture node (celery -A worker.celery worker) needs the broker directories before it consumes"""
+    prepare_celery_storage()
+
+@worker_ready.connect
+def serve_capture_node_metrics(**kwargs):
+    """Export a capture node's metrics (celery -A worker.celery worker --pool=threads) on WORKER_METRICS_PORT"""
+    if app.config['WORKER_METRICS_PORT']:
+        metrics.serve(app.config['WORKER_METRICS_PORT'])
+        print(f"📈 Metrics on port {app.config['WORKER_METRICS_PORT']}")
+
+# Background processing: workers claim pending jobs from the Job table
+worker_threads = []
+worker_running = False
+
+def wait_for_dismissal(driver, button, timeout=5):
+    """Wait until a clicked consent button has left the page"""
+    try:
+        WebDriverWait(driver, timeout).until(EC.staleness_of(button))
+    except TimeoutException:
+        pass
+
+def handle_cookie_consent(driver, timeout=10):
+    """Handle Google cookie consent dialog"""
+    try:
+        # Wait for cookie consent dialog to appear
+        wait = WebDriverWait(driver, timeout)
+        
+        # Try to find and click "Accept all" button
+        try:
+            accept_button = wait.until(
+                EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Accept all')]"))
+            )
+            accept_button.click()
+            print("✅ Cookie consent accepted automatically")
+            wait_for_dismissal(driver, accept_button)
+            return True
+        except TimeoutException:
+            pass
+        
+        # Try alternative selectors for accept button
+        try:
+            accept_button = driver.find_element(By.XPATH, "//button[contains(@aria-label, 'Accept')]")
+            accept_button.click()
+            print("✅ Cookie consent accepted (alternative method)")
+            wait_for_dismissal(driver, accept_button)
+            return True
+        except NoSuchElementException:
+            pass
+        
+        # If no accept button found, try to find and click "Reject all"
+        try:
+            reject_button = driver.find_element(By.XPATH, "//button[contains(., 'Reject all')]")
+            reject_button.click()
+            print("✅ Cookie consent rejected")
+            wait_for_dismissal(driver, reject_button)
+            return True
+        except NoSuchElementException:
+            pass
+        
+        print("⚠️ No cookie consent dialog found or handled")
+        return False
+        
+    except Exception as e:
+        print(f"⚠️ Error handling cookie consent: {e}")
+        return False
+
+def profile_in_use(profile_dir):
+    """Whether a running Chrome, possibly of another worker process, holds profile_dir.
+    
+    Chrome's SingletonLock is a symlink to "<hostname>-<pid>" of the
+    browser that owns the profile. A lock left by a Chrome that died is
+    stale; one from another host (a shared volume) cannot be checked and
+    counts as held.
+    """
+    try:
+        owner = os.readlink(os.path.join(profile_dir, 'SingletonLock'))
+    except OSError:
+        return False
+    host, _, pid = owner.rpartition('-')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Run before any page script on every document the session loads. Besides
+# hiding navigator.webdriver and keeping more than the default 250 resource
+# timing entries (Maps fetches far more), it counts the fetch and XHR
+# requests still waiting for a response, which resource timing cannot show:
+# an entry only appears once its response has finished.
+PAGE_START_SCRIPT = """
+Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+performance.setResourceTimingBufferSize(100000);
+window.__routeInFlight = 0;
+window.__routeLastResponse = 0;
+const routeRequestDone = () => {
+    window.__routeInFlight -= 1;
+    window.__routeLastResponse = performance.now();
+};
+const routeFetch = window.fetch;
+window.fetch = function () {
+    window.__routeInFlight += 1;
+    return routeFetch.apply(this, arguments).finally(routeRequestDone);
+};
+const routeSend = XMLHttpRequest.prototype.send;
+XMLHttpRequest.prototype.send = function () {
+    window.__routeInFlight += 1;
+    this.addEventListener('loadend', routeRequestDone, {once: true});
+    return routeSend.apply(this, arguments);
+};
+"""
+
+@contextmanager
+def profile_launch_lock(profile_dir):
+    """Exclusive lock on profile_dir, held while a Chrome is checked for and started there.
+    
+    Worker processes on one host take it in turn, so two of them cannot
+    both find the profile free and launch a Chrome into it. There is no
+    lock where fcntl is missing (Windows).
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(profile_dir, '.launch.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def create_chrome_driver(profile_dir=None):
+    """Launch a headless Chrome configured for Google Maps captures.
+    
+    With a profile_dir, cookies (including the Google consent choice)
+    persist across launches.
+    """
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")  # ENABLED: Headless mode for faster processing
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument(f"--window-size={CAPTURE_VIEWPORT.replace('x', ',')}")
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    if not profile_dir:
+        driver = webdriver.Chrome(options=chrome_options)
+    else:
+        os.makedirs(profile_dir, exist_ok=True)
+        chrome_options.add_argument(f"--user-data-dir={os.path.abspath(profile_dir)}")
+        # Held until Chrome has written its own SingletonLock
+        with profile_launch_lock(profile_dir):
+            if profile_in_use(profile_dir):
+                raise RuntimeError(f"Chrome profile {profile_dir} is in use by another Chrome")
+            # A Chrome that died without cleaning up leaves its lock behind
+            for lock_name in ('SingletonLock', 'SingletonCookie', 'SingletonSocket'):
+                lock_path = os.path.join(profile_dir, lock_name)
+                if os.path.lexists(lock_path):
+                    os.remove(lock_path)
+            driver = webdriver.Chrome(options=chrome_options)
+    
+    try:
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': PAGE_START_SCRIPT})
+    except Exception as e:
+        print(f"⚠️ Could not install page start script: {e}")
+    return driver
+
+def driver_is_alive(driver):
+    """Return True if the Chrome session still answers commands"""
+    try:
+        driver.execute_script("return 1")
+        return True
+    except Exception:
+        return False
+
+def quit_driver(driver):
+    """Quit a driver, ignoring errors from an already dead Chrome"""
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+class BrowserSession:
+    """A Chrome driver bound to a persistent profile slot, watched for memory growth and slowdown"""
+    
+    def __init__(self, driver, slot, profile_dir):
+        self.driver = driver
+        self.slot = slot
+        self.profile_dir = profile_dir
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.routes_captured = 0
+        self.in_page_failures = 0  # in-page navigations in a row that had to be reloaded
+        self.watchdog = SessionWatchdog(
+            driver_pid(driver),
+            max_routes=app.config['DRIVER_MAX_ROUTES'],
+            max_rss_bytes=app.config['DRIVER_MAX_RSS_MB'] * 1024 * 1024,
+            slowdown_factor=app.config['DRIVER_SLOWDOWN_FACTOR'],
+            sample_every=app.config['DRIVER_MEMORY_CHECK_EVERY'],
+        )
+    
+    def captured(self, seconds):
+        """Count a capture that took seconds; returns why the session is due for recycling, or None"""
+        self.routes_captured += 1
+        reason = self.watchdog.record(seconds)
+        if self.watchdog.rss is not None and self.watchdog.routes % self.watchdog.sample_every == 0:
+            metrics.chrome_session_rss_bytes.observe(self.watchdog.rss)
+        return reason
+
+class DriverManager:
+    """Keeps warm Chrome sessions alive between jobs.
+    
+    Sessions are launched on demand, each on its own profile slot under
+    CHROME_PROFILE_DIR so consent cookies survive a relaunch. Slot
+    directories are named after the host, and a slot whose profile another
+    process's Chrome still holds is skipped, so worker processes and
+    containers sharing the directory never run two Chromes on one profile. Released
+    sessions stay open (up to WARM_DRIVERS of them) and are health-checked
+    before being handed out again; broken or long-idle sessions are quit.
+    Sessions the watchdog flags (too many routes, too much memory, slowed
+    down) are recycled between routes and the last recycles are kept for
+    /debug.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = []
+        self.busy_slots = set()
+        self.launches = 0
+        self.recycles = deque(maxlen=50)
+    
+    @staticmethod
+    def profile_dir(slot):
+        return os.path.join(app.config['CHROME_PROFILE_DIR'], f"{socket.gethostname()}-slot-{slot}")
+    
+    def _claim_slot(self):
+        idle_slots = {session.slot for session in self.idle}
+        slot = 0
+        while slot in self.busy_slots or slot in idle_slots or profile_in_use(self.profile_dir(slot)):
+            slot += 1
+        self.busy_slots.add(slot)
+        return slot
+    
+    def _update_gauges(self):
+        """Export the session counts (call with the lock held)"""
+        metrics.active_drivers.set(len(self.busy_slots))
+        metrics.warm_drivers.set(len(self.idle))
+    
+    def acquire(self):
+        """Return a healthy session, reusing a warm one when possible"""
+        while True:
+            with self.lock:
+                session = self.idle.pop() if self.idle else None
+                if session is not None:
+                    self.busy_slots.add(session.slot)
+                else:
+                    slot = self._claim_slot()
+                self._update_gauges()
+            
+            if session is None:
+                break
+            if driver_is_alive(session.driver):
+                print(f"♻️ Reusing warm Chrome session (slot {session.slot})")
+                return session
+            print(f"⚠️ Warm Chrome session (slot {session.slot}) failed health check")
+            self.discard(session)
+        
+        profile_dir = self.profile_dir(slot)
+        try:
+            driver = create_chrome_driver(profile_dir)
+        except Exception:
+            with self.lock:
+                self.busy_slots.discard(slot)
+                self._update_gauges()
+            raise
+        with self.lock:
+            self.launches += 1
+        metrics.chrome_launches_total.inc()
+        print(f"🚀 Launched Chrome session (slot {slot})")
+        return BrowserSession(driver, slot, profile_dir)
+    
+    def release(self, session):
+        """Return a session after use; keep it warm if there is room"""
+        session.last_used = time.monotonic()
+        with self.lock:
+            self.busy_slots.discard(session.slot)
+            keep = len(self.idle) < app.config['WARM_DRIVERS']
+            if keep:
+                self.idle.append(session)
+            self._update_gauges()
+        if not keep:
+            quit_driver(session.driver)
+    
+    def discard(self, session):
+        """Quit a broken session so its slot can be relaunched"""
+        quit_driver(session.driver)
+        metrics.chrome_restarts_total.inc()
+        with self.lock:
+            self.busy_slots.discard(session.slot)
+            self._update_gauges()
+    
+    def recycle(self, session, reason):
+        """Quit a healthy session the watchdog flagged; the next acquire launches a fresh one"""
+        kind, detail = reason
+        watchdog = session.watchdog
+        print(f"🔁 Recycling Chrome session (slot {session.slot}) after {detail}")
+        quit_driver(session.driver)
+        metrics.chrome_recycles_total.labels(kind).inc()
+        with self.lock:
+            self.busy_slots.discard(session.slot)
+            self.recycles.append({
+                'at': datetime.utcnow().isoformat(),
+                'slot': session.slot,
+                'reason': kind,
+                'detail': detail,
+                'routes': session.routes_captured,
+                'rss_mb': round(watchdog.peak_rss / (1024 * 1024)) if watchdog.peak_rss else None,
+                'age_seconds': round(time.monotonic() - session.created_at),
+            })
+            self._update_gauges()
+    
+    def reap_idle(self):
+        """Quit warm sessions that have been idle longer than DRIVER_IDLE_TIMEOUT"""
+        cutoff = time.monotonic() - app.config['DRIVER_IDLE_TIMEOUT']
+        with self.lock:
+            expired = [session for session in self.idle if session.last_used < cutoff]
+            self.idle = [session for session in self.idle if session.last_used >= cutoff]
+            self._update_gauges()
+        for session in expired:
+            print(f"💤 Closing idle Chrome session (slot {session.slot})")
+            quit_driver(session.driver)
+    
+    def shutdown(self):
+        """Quit every warm session"""
+        with self.lock:
+            sessions, self.idle = self.idle, []
+            self._update_gauges()
+        for session in sessions:
+            quit_driver(session.driver)
+
+driver_manager = DriverManager()
+atexit.register(driver_manager.shutdown)
+
+class RouteScheduler:
+    """Hands out Chrome capture slots one route at a time, fairly across jobs.
+    
+    Every running job's drivers ask for a slot before each capture, so a
+    big job never holds the browsers for longer than one route. When a slot
+    frees up it goes to a waiting job of the user with the fewest routes
+    capturing relative to that job's priority weight (weighted fair share
+    between users); between jobs of the same user, the higher priority and
+    then the older job goes first. MAX_USER_ROUTES caps one user's routes
+    capturing at once. Slots are per process.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.jobs = {}
+        self.users = {}  # user_id -> routes capturing
+        self.running = 0
+    
+    def register(self, job_id, user_id, priority=0, order=0):
+        with self.condition:
+            self.jobs[job_id] = {
+                'user_id': user_id, 'weight': priority_weight(priority), 'priority': priority or 0,
+                'order': order, 'running': 0, 'waiting': 0,
+            }
+            self.users.setdefault(user_id, 0)
+    
+    def unregister(self, job_id):
+        with self.condition:
+            job = self.jobs.pop(job_id, None)
+            if job is not None and not any(other['user_id'] == job['user_id'] for other in self.jobs.values()):
+                self.users.pop(job['user_id'], None)
+            self.condition.notify_all()
+    
+    def _next_job(self):
+        """The waiting job that should get the next free slot (call with the lock held)"""
+        if self.running >= max(1, app.config['CAPTURE_SLOTS']):
+            return None
+        user_limit = app.config['MAX_USER_ROUTES']
+        candidates = [
+            (self.users[job['user_id']] / job['weight'], -job['priority'], job['order'], job_id)
+            for job_id, job in self.jobs.items()
+            if job['waiting'] and not (user_limit and self.users[job['user_id']] >= user_limit)
+        ]
+        return min(candidates)[-1] if candidates else None
+    
+    def acquire(self, job_id, timeout=None):
+        """Wait for a capture slot for job_id; returns False if none came within timeout"""
+        with self.condition:
+            job = self.jobs[job_id]
+            job['waiting'] += 1
+            try:
+                granted = self.condition.wait_for(lambda: self._next_job() == job_id, timeout)
+                if granted:
+                    self.running += 1
+                    job['running'] += 1
+                    self.users[job['user_id']] += 1
+                return granted
+            finally:
+                job['waiting'] -= 1
+                # Whoever is next in line now may be a thread of another job
+                self.condition.notify_all()
+    
+    def release(self, job_id):
+        with self.condition:
+            job = self.jobs[job_id]
+            self.running -= 1
+            job['running'] -= 1
+            self.users[job['user_id']] -= 1
+            self.condition.notify_all()
+    
+    def snapshot(self):
+        with self.condition:
+            return {
+                'slots': app.config['CAPTURE_SLOTS'],
+                'running': self.running,
+                'jobs': {
+                    job_id: {'running': job['running'], 'waiting': job['waiting'], 'priority': job['priority']}
+                    for job_id, job in self.jobs.items()
+                },
+            }
+
+route_scheduler = RouteScheduler()
+
+screenshot_cache = ScreenshotCache(
+    app.config['SCREENSHOT_CACHE_DIR'],
+    max_bytes=app.config['SCREENSHOT_CACHE_MAX_MB'] * 1024 * 1024,
+    ttl_seconds=app.config['SCREENSHOT_CACHE_TTL_HOURS'] * 3600,
+)
+
+# Browser viewport, part of the screenshot cache key
+CAPTURE_VIEWPORT = '1920x1080'
+
+def capture_settings(engine='chrome'):
+    """Settings that change what a capture looks like (part of the cache key)"""
+    settings = {'engine': engine, 'format': app.config['CAPTURE_FORMAT']}
+    if engine == 'chrome' and app.config['MAPS_BASE_URL'] != GOOGLE_MAPS_URL:
+        settings['maps'] = app.config['MAPS_BASE_URL']
+    if app.config['CAPTURE_FORMAT'] != 'png':
+        settings['quality'] = app.config['CAPTURE_QUALITY']
+        if engine == 'chrome':
+            # Chrome's and Pillow's lossy encoders produce different images
+            settings['encoder'] = app.config['CAPTURE_MODE']
+    if engine == 'tiles':
+        settings['size'] = list(render_size())
+        settings['tiles'] = os.path.abspath(app.config['TILE_DIR'])
+        settings['max_zoom'] = app.config['TILE_MAX_ZOOM']
+        return settings
+    crop = parse_crop(app.config['CAPTURE_CROP'])
+    if crop:
+        settings['crop'] = list(crop)
+    return settings
+
+def render_size():
+    """Size of tile-rendered images: the same as a cropped Chrome capture"""
+    crop = parse_crop(app.config['CAPTURE_CROP'])
+    if crop:
+        return crop[2] - crop[0], crop[3] - crop[1]
+    width, height = CAPTURE_VIEWPORT.split('x')
+    return int(width), int(height)
+
+def render_options():
+    """Keyword arguments for tile_renderer.render_route"""
+    width, height = render_size()
+    return {
+        'tile_dir': app.config['TILE_DIR'],
+        'max_tiles': app.config['TILE_CACHE_TILES'],
+        'width': width,
+        'height': height,
+        'max_zoom': app.config['TILE_MAX_ZOOM'],
+        'output_format': app.config['CAPTURE_FORMAT'],
+        'quality': app.config['CAPTURE_QUALITY'],
+        'thumbnail_width': app.config['THUMBNAIL_WIDTH'],
+    }
+
+def image_options():
+    """Keyword arguments for imaging.process_screenshot"""
+    options = {
+        'output_format': app.config['CAPTURE_FORMAT'],
+        'quality': app.config['CAPTURE_QUALITY'],
+        'crop': parse_crop(app.config['CAPTURE_CROP']),
+        'thumbnail_width': app.config['THUMBNAIL_WIDTH'],
+        'source_format': 'png',
+    }
+    if app.config['CAPTURE_MODE'] == 'devtools':
+        # Chrome already clipped and encoded the capture; only thumbnails are left
+        options['crop'] = None
+        options['source_format'] = app.config['CAPTURE_FORMAT']
+    return options
+
+def quality_settings():
+    """Keyword arguments for capture_quality.assess_capture, or None if no check is enabled"""
+    checks = tuple(name.strip() for name in app.config['QUALITY_CHECKS'].split(',') if name.strip())
+    templates = templates_in(app.config['QUALITY_TEMPLATE_DIR'])
+    if not checks and not templates:
+        return None
+    return {
+        'crop': image_options()['crop'],
+        'checks': checks,
+        'templates': templates,
+        'grey_share': app.config['QUALITY_GREY_SHARE'],
+    }
+
+def check_capture(session, route, data, quality):
+    """Run the quality checks on a Chrome capture; returns what looks wrong with it, or None"""
+    if quality is None:
+        return None
+    try:
+        with stage_timer.measure('quality_check'):
+            issue = assess_capture(data, **quality)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not check the capture of route {route['site_id']}: {e}")
+        return None
+    if issue:
+        metrics.capture_issues_total.labels(issue).inc()
+        if issue == 'consent':
+            # Dismiss it now, or the session's next captures show it too
+            handle_cookie_consent(session.driver, timeout=2)
+    return issue
+
+def recapture_delay(route):
+    """Seconds to wait before capturing a route again after a bad capture, or None once its retries are used up.
+    
+    The wait doubles with each retry, giving a slow map server time to
+    recover; the retry loads the page in full.
+    """
+    retries = route.get('quality_retries', 0)
+    if retries >= app.config['QUALITY_RETRIES']:
+        return None
+    route['quality_retries'] = retries + 1
+    route['reload'] = True
+    return app.config['QUALITY_RETRY_BACKOFF'] * 2 ** retries
+
+image_pool = None
+image_pool_lock = threading.Lock()
+
+def get_image_pool():
+    """Process pool for screenshot post-processing, or None to process in the capture thread"""
+    global image_pool
+    if app.config['IMAGE_WORKERS'] <= 0:
+        return None
+    with image_pool_lock:
+        if image_pool is None:
+            # spawn, not fork: the parent runs Chrome and database threads
+            image_pool = ProcessPoolExecutor(
+                max_workers=app.config['IMAGE_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return image_pool
+
+def reset_image_pool(pool):
+    """Drop a broken pool so the next caller starts a fresh one"""
+    global image_pool
+    with image_pool_lock:
+        if image_pool is pool:
+            image_pool = None
+    pool.shutdown(wait=False)
+
+def thumbnail_path(job_id, archive_name):
+    """Where the dashboard thumbnail of a route screenshot is kept"""
+    stem = os.path.splitext(archive_name)[0]
+    return os.path.join(app.config['THUMBNAIL_DIR'], job_id, stem + '.jpg')
+
+def save_thumbnail(job_id, archive_name, data):
+    path = thumbnail_path(job_id, archive_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as output:
+        output.write(data)
+
+def route_cache_key(route, engine='chrome'):
+    """Screenshot cache key for a planned route"""
+    return ScreenshotCache.key(
+        (route['warehouse_lat'], route['warehouse_lng']),
+        (route['latitude'], route['longitude']),
+        CAPTURE_VIEWPORT,
+        capture_settings(engine),
+    )
+
+# Readiness probe run in the page while a route settles. It reports whether
+# the directions panel and the map canvas are on screen, how many fetch and
+# XHR requests are still open (counted by PAGE_START_SCRIPT), how long ago
+# the last network response finished, and whether a consent dialog is
+# showing.
+SETTLE_PROBE_SCRIPT = """
+const panel = document.querySelector('[id^="section-directions-trip-"]:not([data-stale-route])');
+const canvas = Array.from(document.querySelectorAll('canvas'))
+    .some(c => c.width > 0 && c.height > 0 && c.offsetParent !== null);
+let lastResponse = window.__routeLastResponse || 0;
+for (const entry of performance.getEntriesByType('resource')) {
+    lastResponse = Math.max(lastResponse, entry.responseEnd);
+}
+const consent = location.hostname.startsWith('consent.')
+    || Array.from(document.querySelectorAll('button'))
+        .some(b => /Accept all|Reject all/.test(b.textContent));
+return {
+    panel: panel !== null,
+    canvas: canvas,
+    idleMs: performance.now() - lastResponse,
+    inFlight: window.__routeInFlight || 0,
+    consent: consent
+};
+"""
+
+# Moves a loaded directions page to another route without reloading it:
+# Maps' router picks up the History API change like a back/forward
+# navigation, keeping its scripts and the tiles already fetched. The
+# current directions panel is marked stale and the resource timings are
+# cleared, so the settle probe waits for the new route. Returns false when
+# the page shows no route on the same site and has to be loaded in full.
+IN_PAGE_NAVIGATE_SCRIPT = """
+const target = new URL(arguments[0], location.href);
+const panels = document.querySelectorAll('[id^="section-directions-trip-"]');
+if (panels.length === 0 || target.origin !== location.origin) {
+    return false;
+}
+panels.forEach(panel => panel.setAttribute('data-stale-route', ''));
+performance.clearResourceTimings();
+history.pushState(null, '', target.href);
+window.dispatchEvent(new PopStateEvent('popstate', {state: null}));
+return true;
+"""
+
+# In-page navigations in a row that may fall back to a reload before a
+# session sticks to full page loads (the Maps version does not support it)
+IN_PAGE_MAX_FAILURES = 3
+
+def wait_for_route_settled(driver, timeout=None, idle_window=None, poll_interval=0.1):
+    """Wait until a loaded route is ready to be captured.
+    
+    The page counts as settled once the directions panel is present, the map
+    canvas is painted, no fetch or XHR request is still open and no network
+    response has finished for idle_window seconds. A consent dialog met on the way is handled and waiting resumes.
+    
+    Returns (settle_seconds, settled) where settled is False on timeout.
+    """
+    timeout = app.config['SETTLE_TIMEOUT'] if timeout is None else timeout
+    idle_window = app.config['NETWORK_IDLE_WINDOW'] if idle_window is None else idle_window
+    started = time.monotonic()
+    deadline = started + timeout
+    
+    while time.monotonic() < deadline:
+        try:
+            probe = driver.execute_script(SETTLE_PROBE_SCRIPT)
+        except Exception:
+            # Page is mid-navigation (consent redirect); try again shortly
+            probe = None
+        
+        if probe:
+            if probe['consent']:
+                remaining = max(1, deadline - time.monotonic())
+                with stage_timer.measure('consent'):
+                    handle_cookie_consent(driver, timeout=min(remaining, 10))
+                continue
+            
+            network_idle = probe['inFlight'] == 0 and probe['idleMs'] >= idle_window * 1000
+            if probe['panel'] and probe['canvas'] and network_idle:
+                return time.monotonic() - started, True
+        
+        time.sleep(poll_interval)
+    
+    return time.monotonic() - started, False
+
+def screenshot_clip(driver, crop):
+    """DevTools clip rectangle for a crop box, limited to the visible viewport"""
+    layout = driver.execute_cdp_cmd('Page.getLayoutMetrics', {})
+    viewport = layout.get('cssVisualViewport') or layout['visualViewport']
+    width, height = int(viewport['clientWidth']), int(viewport['clientHeight'])
+    left, top, right, bottom = crop
+    left, top = min(left, width - 1), min(top, height - 1)
+    right, bottom = min(right, width), min(bottom, height)
+    return {'x': left, 'y': top, 'width': right - left, 'height': bottom - top, 'scale': 1}
+
+def take_screenshot(driver):
+    """Screenshot of the current page as bytes.
+    
+    In devtools mode Chrome clips it to CAPTURE_CROP and encodes it as
+    CAPTURE_FORMAT itself (Page.captureScreenshot), so the bytes can go
+    straight into the result ZIP. In webdriver mode it is a full-page PNG
+    that post-processing crops and re-encodes.
+    """
+    if app.config['CAPTURE_MODE'] != 'devtools':
+        return driver.get_screenshot_as_png()
+    
+    params = {'format': app.config['CAPTURE_FORMAT'], 'fromSurface': True}
+    if app.config['CAPTURE_FORMAT'] != 'png':
+        params['quality'] = app.config['CAPTURE_QUALITY']
+    crop = parse_crop(app.config['CAPTURE_CROP'])
+    if crop:
+        params['clip'] = screenshot_clip(driver, crop)
+    result = driver.execute_cdp_cmd('Page.captureScreenshot', params)
+    return base64.b64decode(result['data'])
+
+def navigate_in_page(session, route):
+    """Try to move the session's current Maps page to route; returns False if it needs a full load"""
+    if app.config['NAVIGATION_MODE'] != 'inpage' or session.in_page_failures >= IN_PAGE_MAX_FAILURES:
+        return False
+    if route.get('reload'):
+        return False
+    try:
+        return bool(session.driver.execute_script(IN_PAGE_NAVIGATE_SCRIPT, route['url']))
+    except Exception:
+        return False
+
+def capture_route(session, route):
+    """Navigate a browser session to a single route and take its screenshot.
+    
+    With NAVIGATION_MODE=inpage a session already showing a route moves to
+    the next one inside the page. If the route does not render there within
+    INPAGE_SETTLE_TIMEOUT the page is loaded in full instead. A route
+    captured again after a bad capture is always loaded in full.
+    
+    Returns (image_bytes, settle_seconds, settled).
+    """
+    driver = session.driver
+    with stage_timer.measure('navigate'):
+        in_page = navigate_in_page(session, route)
+        if not in_page:
+            driver.get(route['url'])
+    
+    # Wait for the route and map to render
+    if in_page:
+        settle_seconds, settled = wait_for_route_settled(driver, timeout=app.config['INPAGE_SETTLE_TIMEOUT'])
+        if settled:
+            session.in_page_failures = 0
+            metrics.navigations_total.labels('inpage').inc()
+        else:
+            session.in_page_failures += 1
+            print(f"⚠️ Route {route['site_id']} did not render in place, loading the page instead")
+            with stage_timer.measure('navigate'):
+                driver.get(route['url'])
+            reload_seconds, settled = wait_for_route_settled(driver)
+            settle_seconds += reload_seconds
+            metrics.navigations_total.labels('fallback').inc()
+    else:
+        settle_seconds, settled = wait_for_route_settled(driver)
+        metrics.navigations_total.labels('reload').inc()
+    stage_timer.record('settle', settle_seconds)
+    if not settled:
+        print(f"⚠️ Route {route['site_id']} did not settle within {settle_seconds:.1f}s, capturing anyway")
+    
+    # Take screenshot
+    with stage_timer.measure('screenshot'):
+        data = take_screenshot(driver)
+    return data, settle_seconds, settled
+
+def route_checkpoint(job_id, route, status, started, **fields):
+    """RouteTask values recording how a route ended (attempts include earlier runs of the job and recaptures)"""
+    values = {
+        'job_id': job_id,
+        'route_index': int(route['index']),
+        'site_id': str(route['site_id']),
+        'status': status,
+        'attempts': (
+            route.get('previous_attempts', 0) + route.get('attempts', 0) + route.get('quality_retries', 0) + 1
+        ),
+        'archive_name': None,
+        'cached': False,
+        'settle_seconds': None,
+        'duration_seconds': round(time.monotonic() - started, 3),
+        'error_message': None,
+        'quality_issue': None,
+        'updated_at': datetime.utcnow(),
+    }
+    values.update(fields)
+    return values
+
+def reuse_cached(job_id, archive, archive_name, cache_key, cached_path):
+    """Add a cached screenshot and its thumbnail to a job"""
+    with stage_timer.measure('zip'):
+        archive.add_file(cached_path, archive_name)
+    thumbnail_width = app.config['THUMBNAIL_WIDTH']
+    if thumbnail_width:
+        try:
+            os.makedirs(os.path.dirname(thumbnail_path(job_id, archive_name)), exist_ok=True)
+            shutil.copyfile(
+                screenshot_cache.path_for(cache_key, THUMBNAIL_EXTENSION),
+                thumbnail_path(job_id, archive_name),
+            )
+        except FileNotFoundError:
+            with open(cached_path, 'rb') as cached:
+                save_thumbnail(job_id, archive_name, make_thumbnail(cached.read(), thumbnail_width))
+
+class CaptureProgress:
+    """Bookkeeping of one job's capture, shared by the local pool and the Celery coordinator.
+    
+    Counts finished routes, reports them (progress, checkpoint and metrics)
+    and holds the routes waiting out their quality recapture backoff. Safe
+    to use from several capture threads.
+    """
+    
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.cached = 0
+        self.settle_times = []
+        self.settle_timeouts = 0
+        self.recaptures = []  # heap of (due, order, route) waiting out their backoff
+        self.recapture_order = itertools.count()
+    
+    def route_done(self, route, archive_name, started, settle_seconds=None, settled=True, cached=False):
+        """Count a route whose screenshot is in the result ZIP and checkpoint it as done"""
+        with self.lock:
+            self.completed += 1
+            if cached:
+                self.cached += 1
+            elif settle_seconds is not None:
+                self.settle_times.append(settle_seconds)
+            if not cached:
+                stage_timer.record('route', time.monotonic() - started)
+            if not settled:
+                self.settle_timeouts += 1
+        
+        issue = route.get('quality_issue')
+        completed, total_routes = progress_tracker.route_completed(
+            self.job_id, cached=cached, flagged=bool(issue), checkpoint=route_checkpoint(
+                self.job_id, route, 'done', started,
+                archive_name=archive_name, cached=cached, settle_seconds=settle_seconds, quality_issue=issue,
+            )
+        )
+        metrics.routes_total.labels('cached' if cached else 'captured').inc()
+        note = ' (cached)' if cached else f' (flagged: {issue})' if issue else ''
+        print(f"📊 Progress: {completed}/{total_routes}{note}")
+    
+    def route_failed(self, route, started, error):
+        """Checkpoint a route as failed"""
+        metrics.routes_total.labels('failed').inc()
+        progress_tracker.route_failed(
+            self.job_id,
+            checkpoint=route_checkpoint(self.job_id, route, 'failed', started, error_message=str(error)[:1000]),
+        )
+    
+    def schedule_recapture(self, route, issue):
+        """Queue a route whose capture failed the quality checks again after a backoff.
+        
+        Returns False once the route's recaptures are used up: the route is
+        then flagged with issue and its last capture should be kept.
+        """
+        delay = recapture_delay(route)
+        if delay is None:
+            print(f"⚠️ Route {route['site_id']} still looks {issue}, keeping it flagged")
+            route['quality_issue'] = issue
+            return False
+        print(f"🔁 Route {route['site_id']} looked {issue}, capturing it again in {delay:g}s")
+        progress_tracker.quality_retry(self.job_id)
+        with self.lock:
+            heapq.heappush(self.recaptures, (time.monotonic() + delay, next(self.recapture_order), route))
+        return True
+    
+    def due_recapture(self):
+        """A route whose recapture backoff is over, or None"""
+        with self.lock:
+            if self.recaptures and self.recaptures[0][0] <= time.monotonic():
+                return heapq.heappop(self.recaptures)[2]
+        return None
+    
+    def settle_stats(self):
+        """Summary of the settle times, with the number of pages that never settled"""
+        settle_stats = summarize_durations(self.settle_times)
+        settle_stats['timeouts'] = self.settle_timeouts
+        if self.cached:
+            print(f"🗂️ {self.cached} of {self.completed} routes served from the screenshot cache")
+        return settle_stats
+
+def get_capture_driver_count(route_count):
+    """Number of Chrome drivers to run for a job of route_count routes"""
+    requested = max(1, app.config['CAPTURE_DRIVERS'])
+    limit = max(1, app.config['MAX_CAPTURE_DRIVERS'])
+    return max(1, min(requested, limit, route_count))
+
+def run_capture_pool(job_id, routes, archive, expected_routes, cancel=None, engine='chrome'):
+    """Capture routes with a pool of Chrome drivers sharing one work queue.
+    
+    routes may be any iterable, including a lazy one: a feeder thread pulls
+    from it into a bounded queue while the drivers are already capturing.
+    expected_routes (an estimate is fine) sizes the pool; progress goes to
+    the progress tracker.
+    
+    Screenshots are post-processed (cropped, re-encoded, thumbnailed) in the
+    image process pool while the driver that took them moves on, and each
+    one is appended to archive as soon as it is processed. At most two
+    screenshots per driver wait for processing, so a slow pool holds the
+    drivers back instead of filling memory.
+    
+    With engine='tiles' no Chrome is involved: routes are drawn from local
+    map tiles (tile_renderer) entirely in the image pool, one submitting
+    thread keeping every pool process busy.
+    
+    Each driver pulls the next route from the queue, so the route list is
+    sharded dynamically and a slow driver never holds back the others. If a
+    driver's Chrome crashes, the route it was working on is handed back and
+    a fresh session is taken from the driver manager; a driver that keeps
+    crashing without completing a route retires and leaves the remaining
+    routes to the rest of the pool.
+    
+    Each Chrome capture holds one of the route scheduler's slots, which
+    the job must be registered with; between routes the drivers may have to
+    wait while other jobs capture.
+    
+    Every Chrome capture goes through the quality checks (capture_quality)
+    before it is processed. One that looks blank, grey or covered by the
+    consent dialog is not kept: its route goes back to the queue after a
+    backoff (recapture_delay), while the driver carries on with other
+    routes. Once QUALITY_RETRIES recaptures are used up the last capture is
+    kept anyway, but not cached, and the route is flagged.
+    
+    Setting the optional cancel event stops the pool after the routes in
+    flight; the routes not yet captured are left alone.
+    
+    Every finished route is checkpointed through the progress tracker, done
+    or failed, with the attempts made so far (a route's 'previous_attempts'
+    counts those of earlier runs of the job).
+    
+    Returns the number of completed routes and a summary of their settle times.
+    """
+    if engine == 'tiles' and app.config['IMAGE_WORKERS'] > 0:
+        driver_count = 1
+    else:
+        driver_count = get_capture_driver_count(expected_routes or app.config['MAX_CAPTURE_DRIVERS'])
+    route_queue = queue.Queue(maxsize=driver_count * 16)
+    retry_queue = queue.Queue()
+    feed_done = threading.Event()
+    stop = threading.Event()
+    
+    progress = CaptureProgress(job_id)
+    counter_lock = threading.Lock()
+    state = {'retired': 0, 'feed_error': None}
+    max_restarts = app.config['DRIVER_RESTART_LIMIT']
+    
+    options = image_options()
+    extension = extension_for(options['output_format'])
+    processing = threading.Condition()
+    in_flight = {'count': 0}
+    max_in_flight = max(driver_count, app.config['IMAGE_WORKERS']) * 2
+    tile_options = render_options() if engine == 'tiles' else None
+    quality = quality_settings() if engine == 'chrome' else None
+    
+    def feed():
+        try:
+            for route in routes:
+                while not stop.is_set():
+                    try:
+                        route_queue.put(route, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            state['feed_error'] = e
+            stop.set()
+        finally:
+            feed_done.set()
+    
+    def next_route():
+        """Next route to capture, or None once all work is handed out"""
+        while not stop.is_set():
+            if cancel is not None and cancel.is_set():
+                stop.set()
+                return None
+            recapture = progress.due_recapture()
+            if recapture is not None:
+                return recapture
+            try:
+                return retry_queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                return route_queue.get(timeout=0.2)
+            except queue.Empty:
+                if feed_done.is_set() and route_queue.empty() and retry_queue.empty() and not progress.recaptures:
+                    return None
+        return None
+    
+    def store_result(route, archive_name, cache_key, started, image, thumbnail, settle_seconds, settled):
+        """Save a processed screenshot to the cache, the result ZIP and the thumbnails"""
+        with stage_timer.measure('store'):
+            save_result(route, archive_name, cache_key, image, thumbnail, settled)
+        progress.route_done(route, archive_name, started, settle_seconds, settled)
+    
+    def save_result(route, archive_name, cache_key, image, thumbnail, settled):
+        if settled and not route.get('quality_issue'):
+            # Only cache captures of fully rendered pages
+            try:
+                screenshot_cache.store_bytes(cache_key, image, extension)
+                if thumbnail:
+                    screenshot_cache.store_bytes(cache_key, thumbnail, THUMBNAIL_EXTENSION)
+            except OSError as e:
+                print(f"⚠️ Could not cache screenshot for route {route['index']}: {e}")
+        with stage_timer.measure('zip'):
+            added = archive.add_bytes(image, archive_name)
+        if not added:
+            print(f"⚠️ Duplicate site ID {route['site_id']}, keeping the first screenshot")
+        if thumbnail:
+            save_thumbnail(job_id, archive_name, thumbnail)
+    
+    def finish_processing():
+        with processing:
+            in_flight['count'] -= 1
+            processing.notify_all()
+    
+    def post_process(route, archive_name, cache_key, started, data, settle_seconds, settled):
+        """Hand a screenshot to the image pool, or process it here if there is none"""
+        if not needs_processing(**options):
+            store_result(route, archive_name, cache_key, started, data, None, settle_seconds, settled)
+            return
+        run_image_work(
+            process_screenshot, (data,), options,
+            route, archive_name, cache_key, started, settle_seconds, settled,
+        )
+    
+    def run_image_work(work, args, kwargs, route, archive_name, cache_key, started, settle_seconds, settled):
+        """Run work(*args, **kwargs), which returns (image, thumbnail), and store the result.
+        
+        The work goes to the image pool when there is one; the calling thread
+        only waits if too many results are already outstanding.
+        """
+        pool = get_image_pool()
+        if pool is not None:
+            with processing:
+                while in_flight['count'] >= max_in_flight:
+                    processing.wait()
+                in_flight['count'] += 1
+            submitted = time.monotonic()
+            try:
+                future = pool.submit(work, *args, **kwargs)
+            except (BrokenProcessPool, RuntimeError) as e:
+                print(f"⚠️ Image pool unavailable, processing in the capture thread: {e}")
+                reset_image_pool(pool)
+                finish_processing()
+            else:
+                def processed(future):
+                    try:
+                        image, thumbnail = future.result()
+                        # Includes time queued behind other screenshots
+                        stage_timer.record('process', time.monotonic() - submitted)
+                        store_result(route, archive_name, cache_key, started, image, thumbnail, settle_seconds, settled)
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool):
+                            reset_image_pool(pool)
+                        print(f"❌ Error post-processing route {route['index']}: {e}")
+                        progress.route_failed(route, started, e)
+                    finally:
+                        finish_processing()
+                
+                future.add_done_callback(processed)
+                return
+        
+        with stage_timer.measure('process'):
+            image, thumbnail = work(*args, **kwargs)
+        store_result(route, archive_name, cache_key, started, image, thumbnail, settle_seconds, settled)
+    
+    def driver_loop(slot):
+        restarts = 0
+        session = None
+        
+        try:
+            while True:
+                route = next_route()
+                if route is None:
+                    return
+                
+                started = time.monotonic()
+                archive_name = f"route_{route['site_id']}{extension}"
+                cache_key = route_cache_key(route, engine)
+                with stage_timer.measure('cache_lookup'):
+                    cached_path = screenshot_cache.lookup(cache_key, extension)
+                if cached_path:
+                    try:
+                        reuse_cached(job_id, archive, archive_name, cache_key, cached_path)
+                        progress.route_done(route, archive_name, started, cached=True)
+                        continue
+                    except OSError as e:
+                        print(f"⚠️ Could not reuse cached screenshot for route {route['index']}: {e}")
+                
+                if engine == 'tiles':
+                    try:
+                        run_image_work(
+                            render_route, (route,), tile_options,
+                            route, archive_name, cache_key, started, None, True,
+                        )
+                    except Exception as e:
+                        print(f"❌ Error rendering route {route['index']}: {e}")
+                        progress.route_failed(route, started, e)
+                    continue
+                
+                if not route_scheduler.acquire(job_id, timeout=0):
+                    if session is not None:
+                        # Another job's turn: hand the browser back while waiting
+                        driver_manager.release(session)
+                        session = None
+                    while not route_scheduler.acquire(job_id, timeout=0.5):
+                        if stop.is_set() or (cancel is not None and cancel.is_set()):
+                            return
+                
+                try:
+                    try:
+                        if session is None:
+                            with stage_timer.measure('browser_start'):
+                                session = driver_manager.acquire()
+                        
+                        print(f"📍 [driver {slot}] Processing route {route['index'] + 1}: {route['site_id']}")
+                        capture_started = time.monotonic()
+                        data, settle_seconds, settled = capture_route(session, route)
+                    finally:
+                        route_scheduler.release(job_id)
+                    restarts = 0
+                    recycle_reason = session.captured(time.monotonic() - capture_started)
+                    issue = check_capture(session, route, data, quality)
+                    if not issue or not progress.schedule_recapture(route, issue):
+                        post_process(route, archive_name, cache_key, started, data, settle_seconds, settled)
+                    if recycle_reason:
+                        # Between routes, so nothing in flight is lost
+                        driver_manager.recycle(session, recycle_reason)
+                        session = None
+                    
+                except Exception as e:
+                    if session is not None and driver_is_alive(session.driver):
+                        # The page misbehaved but Chrome is fine: skip this route
+                        print(f"❌ Error processing route {route['index']}: {e}")
+                        progress.route_failed(route, started, e)
+                        continue
+                    
+                    # Chrome is gone: hand the route back and relaunch the driver
+                    print(f"⚠️ [driver {slot}] Chrome crashed on route {route['index']}: {e}")
+                    if route.get('attempts', 0) < 1:
+                        route['attempts'] = route.get('attempts', 0) + 1
+                        retry_queue.put(route)
+                    else:
+                        print(f"❌ Giving up on route {route['index']} after a second crash")
+                        progress.route_failed(route, started, e)
+                    
+                    if session is not None:
+                        driver_manager.discard(session)
+                        session = None
+                    
+                    restarts += 1
+                    if restarts > max_restarts:
+                        print(f"❌ [driver {slot}] Restart limit reached, retiring driver")
+                        with counter_lock:
+                            state['retired'] += 1
+                        return
+        finally:
+            if session is not None:
+                driver_manager.release(session)
+    
+    if engine == 'tiles':
+        print(f"🗺️ Rendering routes from map tiles in {app.config['TILE_DIR']}")
+    else:
+        print(f"🚗 Capturing routes with {driver_count} Chrome driver(s)")
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    
+    try:
+        while True:
+            state['retired'] = 0
+            threads = [
+                threading.Thread(target=driver_loop, args=(slot,), daemon=True)
+                for slot in range(driver_count)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            
+            if stop.is_set():
+                break
+            # Routes handed back by a driver that then retired are picked up by
+            # another round, unless every driver in this round gave up.
+            if state['retired'] == driver_count:
+                raise RuntimeError(
+                    f"All Chrome drivers failed after capturing {progress.completed} routes"
+                )
+            if feed_done.is_set() and route_queue.empty() and retry_queue.empty() and not progress.recaptures:
+                break
+    finally:
+        stop.set()
+        feeder.join()
+        # Let screenshots still in the image pool reach the archive
+        with processing:
+            while in_flight['count']:
+                processing.wait()
+    
+    if state['feed_error'] is not None:
+        raise state['feed_error']
+    
+    return progress.completed, progress.settle_stats()
+
+def route_part_dir(job_id):
+    """Directory on the shared screenshots volume where capture nodes leave a job's images"""
+    return os.path.join('screenshots', 'parts', str(job_id))
+
+def write_part(directory, name, data):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    # Renamed into place so the coordinator never reads a partial file
+    os.replace(temporary, path)
+
+# Reports STARTED, so the coordinator times a route from when a node picks it up
+@celery.task(name='app.capture_route', track_started=True)
+def capture_route_task(job_id, route, engine='chrome'):
+    """Capture (or render) one route of a job on whichever capture node picks it up.
+    
+    The image and its thumbnail go to the job's parts directory on the
+    shared screenshots volume, named after the route index. Returns their
+    file names, the settle time and what the quality checks found wrong
+    with the capture (None if nothing), or an error message if the page
+    misbehaved; raises if Chrome crashed so the coordinator can retry the
+    route.
+    """
+    options = image_options()
+    result = {
+        'image': None, 'thumbnail': None, 'settle_seconds': None, 'settled': True,
+        'quality_issue': None, 'error': None,
+    }
+    
+    if engine == 'tiles':
+        try:
+            image, thumbnail = render_route(route, **render_options())
+        except Exception as e:
+            result['error'] = str(e)[:1000]
+            return result
+    else:
+        with stage_timer.measure('browser_start'):
+            session = driver_manager.acquire()
+        try:
+            print(f"📍 Processing route {route['index'] + 1} of job {job_id}: {route['site_id']}")
+            capture_started = time.monotonic()
+            data, settle_seconds, settled = capture_route(session, route)
+            recycle_reason = session.captured(time.monotonic() - capture_started)
+            result['quality_issue'] = check_capture(session, route, data, quality_settings())
+        except Exception as e:
+            if not driver_is_alive(session.driver):
+                # Chrome is gone: fail the task so the coordinator hands the route out again
+                driver_manager.discard(session)
+                raise
+            driver_manager.release(session)
+            result['error'] = str(e)[:1000]
+            return result
+        if recycle_reason:
+            driver_manager.recycle(session, recycle_reason)
+        else:
+            driver_manager.release(session)
+        result['settle_seconds'], result['settled'] = settle_seconds, settled
+        with stage_timer.measure('process'):
+            image, thumbnail = process_screenshot(data, **options)
+    
+    directory = route_part_dir(job_id)
+    result['image'] = f"{route['index']}{extension_for(options['output_format'])}"
+    write_part(directory, result['image'], image)
+    if thumbnail:
+        result['thumbnail'] = f"{route['index']}{THUMBNAIL_EXTENSION}"
+        write_part(directory, result['thumbnail'], thumbnail)
+    return result
+
+def run_distributed_capture(job_id, routes, archive, expected_routes, cancel=None, engine='chrome'):
+    """Capture routes as Celery tasks spread over every capture node.
+    
+    Takes the same arguments and returns the same as run_capture_pool. This
+    process stays the job's coordinator: it checks the screenshot cache,
+    keeps up to CAPTURE_TASK_WINDOW route tasks outstanding, and as results
+    come back moves each image from the shared parts directory into the
+    result ZIP, the cache and the thumbnails, reporting progress and
+    checkpoints through the progress tracker exactly like the local pool.
+    
+    A task that fails (its Chrome crashed, or its worker died) is sent once
+    more before the route counts as failed. One that runs for longer than
+    CAPTURE_TASK_TIMEOUT is revoked and fails its route; time spent queued
+    behind other routes does not count, unless no task has started or
+    finished for that long (e.g. because no capture worker is running). A capture that failed the quality checks
+    is thrown away and its route sent again after a backoff, as in the
+    local pool, until the recaptures run out and it is kept flagged.
+    """
+    prepare_celery_storage()
+    extension = extension_for(app.config['CAPTURE_FORMAT'])
+    window = app.config['CAPTURE_TASK_WINDOW']
+    timeout = app.config['CAPTURE_TASK_TIMEOUT']
+    parts = route_part_dir(job_id)
+    pending = {}  # task id -> (route, async result, started, running since or None while queued)
+    progress = CaptureProgress(job_id)
+    activity = {'last': time.monotonic()}  # when a task last started or finished
+    
+    def send(route, started):
+        result = capture_route_task.delay(job_id, route, engine)
+        pending[result.id] = (route, result, started, None)
+    
+    def store_parts(route, started, payload):
+        archive_name = f"route_{route['site_id']}{extension}"
+        image_path = os.path.join(parts, payload['image'])
+        with stage_timer.measure('zip'):
+            added = archive.add_file(image_path, archive_name)
+        if not added:
+            print(f"⚠️ Duplicate site ID {route['site_id']}, keeping the first screenshot")
+        cache_key = route_cache_key(route, engine)
+        thumbnail = os.path.join(parts, payload['thumbnail']) if payload['thumbnail'] else None
+        if payload['settled'] and not route.get('quality_issue'):
+            # Only cache captures of fully rendered pages
+            try:
+                screenshot_cache.store(cache_key, image_path, extension)
+                if thumbnail:
+                    screenshot_cache.store(cache_key, thumbnail, THUMBNAIL_EXTENSION)
+            except OSError as e:
+                print(f"⚠️ Could not cache screenshot for route {route['index']}: {e}")
+        if thumbnail:
+            os.makedirs(os.path.dirname(thumbnail_path(job_id, archive_name)), exist_ok=True)
+            os.replace(thumbnail, thumbnail_path(job_id, archive_name))
+        os.remove(image_path)
+        progress.route_done(route, archive_name, started, payload['settle_seconds'], payload['settled'])
+    
+    def discard_parts(payload):
+        """Remove a capture's files from the parts directory"""
+        for name in (payload['image'], payload['thumbnail']):
+            if name:
+                try:
+                    os.remove(os.path.join(parts, name))
+                except OSError:
+                    pass
+    
+    def collect():
+        """Handle the tasks that finished or timed out; returns how many there were"""
+        finished = 0
+        for task_id, (route, result, started, running_since) in list(pending.items()):
+            status = result.state
+            now = time.monotonic()
+            if status in states.READY_STATES:
+                payload = result.get(propagate=False)
+                error = payload if status != states.SUCCESS else None
+                activity['last'] = now
+            elif running_since is None and status == states.STARTED:
+                pending[task_id] = (route, result, started, now)
+                activity['last'] = now
+                continue
+            elif running_since is not None and now - running_since > timeout:
+                result.revoke()
+                payload = None
+                error = TimeoutError(f"The capture worker did not finish the route within {timeout:.0f}s")
+            elif running_since is None and now - activity['last'] > timeout:
+                result.revoke()
+                payload = None
+                error = TimeoutError(f"No capture worker picked up a route within {timeout:.0f}s")
+            else:
+                continue
+            del pending[task_id]
+            if payload is not None:
+                # A revoked task has no stored result yet to forget
+                result.forget()
+            finished += 1
+            
+            if error is not None:
+                if route.get('attempts', 0) < 1:
+                    print(f"⚠️ Route {route['index']} task failed, sending it again: {error}")
+                    route['attempts'] = route.get('attempts', 0) + 1
+                    send(route, started)
+                else:
+                    print(f"❌ Giving up on route {route['index']}: {error}")
+                    progress.route_failed(route, started, error)
+            elif payload['error']:
+                print(f"❌ Error processing route {route['index']}: {payload['error']}")
+                progress.route_failed(route, started, payload['error'])
+            elif payload.get('quality_issue') and progress.schedule_recapture(route, payload['quality_issue']):
+                discard_parts(payload)  # sent again once its backoff is over
+            else:
+                try:
+                    store_parts(route, started, payload)
+                except OSError as e:
+                    print(f"❌ Error storing route {route['index']}: {e}")
+                    progress.route_failed(route, started, e)
+        return finished
+    
+    print(f"🛰️ Sending routes to capture workers through {app.config['CELERY_BROKER_URL'].split('://')[0]}")
+    routes = iter(routes)
+    exhausted = False
+    try:
+        while True:
+            if cancel is not None and cancel.is_set():
+                break
+            recapture = progress.due_recapture()
+            while recapture is not None:
+                send(recapture, time.monotonic())
+                recapture = progress.due_recapture()
+            while not exhausted and len(pending) < window:
+                route = next(routes, None)
+                if route is None:
+                    exhausted = True
+                    break
+                started = time.monotonic()
+                archive_name = f"route_{route['site_id']}{extension}"
+                cache_key = route_cache_key(route, engine)
+                with stage_timer.measure('cache_lookup'):
+                    cached_path = screenshot_cache.lookup(cache_key, extension)
+                if cached_path:
+                    try:
+                        reuse_cached(job_id, archive, archive_name, cache_key, cached_path)
+                        progress.route_done(route, archive_name, started, cached=True)
+                        continue
+                    except OSError as e:
+                        print(f"⚠️ Could not reuse cached screenshot for route {route['index']}: {e}")
+                send(route, started)
+            if exhausted and not pending and not progress.recaptures:
+                break
+            if not collect():
+                time.sleep(0.2)
+    finally:
+        # Stopped early (lost lease or an error): nobody will collect these
+        for _, result, _, _ in pending.values():
+            result.revoke()
+        if not pending and not (cancel is not None and cancel.is_set()):
+            shutil.rmtree(parts, ignore_errors=True)
+    
+    return progress.completed, progress.settle_stats()
+
+def record_job_plan(job_id, total_routes, warning_message):
+    """Store the number of routes to capture and any skipped-row warning"""
+    progress_tracker.update(job_id, flush=True, total_routes=total_routes, warning_message=warning_message)
+    print(f"✅ Updated total_routes to {total_routes}")
+
+def new_worker_id(index):
+    """Identity a worker thread claims jobs under (unique across hosts and restarts)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{index}:{uuid.uuid4().hex[:8]}"
+
+def claim_next_job(worker_id):
+    """Claim the next runnable job for worker_id; returns (job_id, filepath, render_engine) or None.
+    
+    Runnable means pending, or processing under a lease that has expired
+    because its worker died or hung. Higher priority jobs come first; among
+    jobs of the same priority those of users with the fewest jobs running,
+    then older jobs. Users who already have MAX_USER_JOBS running are
+    skipped, whatever the priority of their jobs. The claim is a
+    conditional UPDATE that only matches while the job is still in the
+    state it was read in, so when several workers (threads or processes
+    sharing the database) race for the same job exactly one of them gets it.
+    """
+    now = datetime.utcnow()
+    lease_expires_at = now + timedelta(seconds=app.config['JOB_LEASE_SECONDS'])
+    lease_expired = and_(
+        Job.status == 'processing',
+        or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < now),
+    )
+    running = dict(
+        db.session.query(Job.user_id, func.count(Job.id))
+        .filter(Job.status == 'processing', Job.lease_expires_at >= now)
+        .group_by(Job.user_id)
+        .all()
+    )
+    user_limit = app.config['MAX_USER_JOBS']
+    busy_users = [user_id for user_id, count in running.items() if user_limit and count >= user_limit]
+    candidates = (
+        db.session.query(
+            Job.id, Job.job_id, Job.filepath, Job.render_engine, Job.status, Job.claimed_by, Job.attempts,
+            Job.user_id, Job.priority,
+        )
+        .filter(or_(Job.status == 'pending', lease_expired), Job.user_id.notin_(busy_users))
+        .order_by(func.coalesce(Job.priority, 0).desc(), Job.created_at, Job.id)
+        .limit(50)
+        .all()
+    )
+    candidates.sort(key=lambda candidate: (-(candidate.priority or 0), running.get(candidate.user_id, 0)))
+    
+    for candidate in candidates:
+        unchanged = and_(
+            Job.id == candidate.id,
+            Job.status == candidate.status,
+            Job.claimed_by.is_(None) if candidate.claimed_by is None else Job.claimed_by == candidate.claimed_by,
+            or_(Job.status == 'pending', lease_expired),
+        )
+        
+        give_up = None
+        if not candidate.filepath:
+            give_up = 'The uploaded file is no longer available, please upload it again'
+        elif (candidate.attempts or 0) >= app.config['MAX_JOB_ATTEMPTS']:
+            give_up = f"Job abandoned after {candidate.attempts} attempts (worker stopped responding)"
+        if give_up:
+            Job.query.filter(unchanged).update(
+                {'status': 'failed', 'error_message': give_up, 'lease_expires_at': None},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            print(f"❌ Job failed: {candidate.job_id} - {give_up}")
+            continue
+        
+        claimed = Job.query.filter(unchanged).update({
+            'status': 'processing',
+            'claimed_by': worker_id,
+            'lease_expires_at': lease_expires_at,
+            'heartbeat_at': now,
+            'started_at': now,
+            'attempts': (candidate.attempts or 0) + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            if candidate.status == 'processing':
+                print(f"♻️ Taking over job {candidate.job_id} from {candidate.claimed_by} (lease expired)")
+            return candidate.job_id, candidate.filepath, candidate.render_engine or 'chrome'
+    return None
+
+def renew_job_lease(job_id, worker_id):
+    """Extend a claimed job's lease; returns False if the worker no longer holds it"""
+    now = datetime.utcnow()
+    renewed = Job.query.filter_by(job_id=job_id, claimed_by=worker_id, status='processing').update({
+        'lease_expires_at': now + timedelta(seconds=app.config['JOB_LEASE_SECONDS']),
+        'heartbeat_at': now,
+    }, synchronize_session=False)
+    db.session.commit()
+    return bool(renewed)
+
+class JobLease:
+    """Heartbeats a claimed job's lease from a background thread while it is processed.
+    
+    The lease is renewed three times per JOB_LEASE_SECONDS. If a renewal
+    finds the job claimed by another worker (this one stalled past its
+    lease), lost is set so the capture pool can stop.
+    """
+    
+    def __init__(self, job_id, worker_id):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+    
+    def run(self):
+        interval = app.config['JOB_LEASE_SECONDS'] / 3
+        while not self.stopped.wait(interval):
+            try:
+                with app.app_context():
+                    held = renew_job_lease(self.job_id, self.worker_id)
+            except Exception as e:
+                # Keep trying; the lease only lapses if this goes on for a while
+                print(f"⚠️ Could not renew lease on job {self.job_id}: {e}")
+                continue
+            if not held and not self.stopped.is_set():
+                print(f"❌ Lost lease on job {self.job_id}, another worker has taken it over")
+                self.lost.set()
+                return
+
+def process_job(worker_id, job_id, filepath, render_engine='chrome'):
+    """Capture every route of a claimed job and write its result ZIP"""
+    print(f"🔄 [{worker_id}] Processing job: {job_id} ({render_engine})")
+    
+    archive = None
+    with app.app_context():
+        job = (
+            db.session.query(Job.id, Job.user_id, Job.priority, Job.total_routes, Job.quality_retries, Job.warning_message)
+            .filter_by(job_id=job_id)
+            .one()
+        )
+    route_scheduler.register(job_id, job.user_id, job.priority, job.id)
+    with JobLease(job_id, worker_id) as lease:
+        try:
+            if render_engine not in RENDER_ENGINES:
+                raise ValueError(f"Unknown render engine: {render_engine}")
+            if render_engine == 'tiles' and not os.path.isdir(app.config['TILE_DIR']):
+                raise ValueError(f"Map tile directory not found: {app.config['TILE_DIR']}")
+            os.makedirs('screenshots', exist_ok=True)
+            zip_path = f"screenshots/{job_id}_routes.zip"
+            archive = ResultArchive(zip_path)
+            
+            # Resuming: routes checkpointed as done whose screenshot made it
+            # into the ZIP are skipped, everything else is (re)captured
+            checkpoints = load_route_checkpoints(job_id)
+            done = {
+                index for index, task in checkpoints.items()
+                if task.status == 'done' and task.archive_name in archive
+            }
+            if done:
+                print(f"⏩ Resuming job {job_id}: {len(done)} routes already captured")
+            progress_tracker.start(
+                job_id, owner=worker_id, result_file=zip_path,
+                completed_routes=len(done),
+                cached_routes=sum(1 for index in done if checkpoints[index].cached),
+                flagged_routes=sum(1 for index in done if checkpoints[index].quality_issue),
+                quality_retries=job.quality_retries or 0,
+                error_message=None,
+            )
+            
+            # Open the route file read-only: sheet names and headers are
+            # validated before any data row is read, and Transportation
+            # rows are then streamed into the capture pool chunk by chunk
+            load_started = time.monotonic()
+            with route_reader(filepath) as workbook:
+                warehouse_df = workbook.read_sheet('Warehouse')
+                # Planned at upload, where skipped rows were already counted
+                # and reported; the file's own estimate is a fallback
+                estimated_routes = job.total_routes or workbook.row_count('Transportation') or 0
+                checked_at_upload = job.warning_message is not None
+                stage_timer.record('excel_load', time.monotonic() - load_started)
+                totals = {'total_routes': estimated_routes}
+                print(f"📊 Total routes to process: about {estimated_routes}")
+                record_job_plan(job_id, estimated_routes, job.warning_message)
+                
+                skipped = RoutePlan([], {}, [], 0)
+                planned = {'routes': 0}
+                
+                def planned_routes():
+                    chunks = workbook.iter_chunks('Transportation', app.config['INGEST_CHUNK_SIZE'])
+                    plans = iter_route_plans(chunks, warehouse_df, app.config['MAPS_BASE_URL'])
+                    while True:
+                        # Reading a chunk of rows and planning it
+                        with stage_timer.measure('plan'):
+                            plan = next(plans, None)
+                        if plan is None:
+                            break
+                        planned['routes'] += len(plan.routes)
+                        if plan.skipped_count:
+                            skipped.absorb_skipped(plan)
+                            print(f"⚠️ Skipping {plan.skipped_count} rows: {plan.describe_skipped()}")
+                            if not checked_at_upload:
+                                # Queued before uploads were planned: report skipped
+                                # rows before their chunk is captured
+                                totals['total_routes'] = max(planned['routes'], estimated_routes - skipped.skipped_count)
+                                record_job_plan(job_id, totals['total_routes'], skipped.describe_skipped())
+                        for route in plan.routes:
+                            if route['index'] in done:
+                                continue
+                            if route['index'] in checkpoints:
+                                route['previous_attempts'] = checkpoints[route['index']].attempts or 0
+                            yield route
+                    
+                    # Blank trailing rows make the sheet dimensions overcount
+                    if totals['total_routes'] != planned['routes']:
+                        totals['total_routes'] = planned['routes']
+                        record_job_plan(job_id, planned['routes'], skipped.describe_skipped())
+                
+                routes = planned_routes()
+                if app.config['ROUTE_ORDER'] == 'locality':
+                    # Neighbouring routes back to back keep the map cached in the browser
+                    routes = iter_by_locality(routes, app.config['ROUTE_ORDER_WINDOW'])
+                
+                if app.config['CAPTURE_BACKEND'] == 'celery':
+                    capture = run_distributed_capture
+                else:
+                    capture = run_capture_pool
+                _, settle_stats = capture(
+                    job_id, routes, archive, max(1, estimated_routes - len(done)),
+                    cancel=lease.lost, engine=render_engine,
+                )
+                print(f"⏱️ Settle times: {settle_stats}")
+            
+            if lease.lost.is_set():
+                # The worker that took over owns the job and its ZIP now
+                progress_tracker.discard(job_id)
+                print(f"⚠️ Stopped job {job_id} after losing its lease")
+                return
+            
+            if not planned['routes']:
+                raise ValueError(
+                    f"No routes to capture: {skipped.describe_skipped() or 'Transportation sheet is empty'}"
+                )
+            
+            # Finish the ZIP (screenshots were added as they were taken)
+            with stage_timer.measure('zip'):
+                archive.close()
+            
+            # Update job status
+            progress_tracker.finish(
+                job_id,
+                status='completed',
+                progress=100,
+                completed_at=datetime.utcnow(),
+                settle_stats=json.dumps(settle_stats),
+                lease_expires_at=None,
+            )
+            metrics.jobs_total.labels('completed').inc()
+            print(f"✅ Job completed: {job_id}")
+                
+        except Exception as e:
+            # Update job status on error
+            progress_tracker.finish(job_id, status='failed', error_message=str(e), lease_expires_at=None)
+            metrics.jobs_total.labels('failed').inc()
+            print(f"❌ Job failed: {job_id} - {e}")
+        finally:
+            route_scheduler.unregister(job_id)
+            # Keep what was captured downloadable
+            if archive is not None:
+                if lease.lost.is_set():
+                    archive.abandon()
+                else:
+                    archive.close()
+
+def process_screenshots_worker(worker_id):
+    """Background worker: claim jobs from the database and process them one at a time"""
+    print(f"🔄 Background worker {worker_id} started and ready to process tasks")
+    
+    while worker_running:
+        try:
+            with app.app_context():
+                claimed = claim_next_job(worker_id)
+            if claimed is None:
+                driver_manager.reap_idle()
+                time.sleep(app.config['QUEUE_POLL_INTERVAL'])
+                continue
+            
+            process_job(worker_id, *claimed)
+            
+        except Exception as e:
+            print(f"Worker error: {e}")
+            time.sleep(app.config['QUEUE_POLL_INTERVAL'])
+            continue
+
+def start_worker():
+    """Start the background workers (WORKER_THREADS of them)"""
+    global worker_running
+    
+    worker_running = True
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+    
+    alive = [thread for thread in worker_threads if thread.is_alive()]
+    worker_threads[:] = alive
+    for index in range(len(alive), app.config['WORKER_THREADS']):
+        thread = threading.Thread(
+            target=process_screenshots_worker, args=(new_worker_id(index),), daemon=True
+        )
+        thread.start()
+        worker_threads.append(thread)
+    print(f"✅ Background workers started ({len(worker_threads)})")
+
+def worker_stats():
+    """This process's worker, Chrome, cache and stage timing state, for /debug"""
+    return {
+        'progress_db_writes': progress_tracker.db_writes,
+        'stage_seconds': stage_timer.summary(),
+        'worker_running': worker_running,
+        'worker_threads': len(worker_threads),
+        'worker_threads_alive': sum(thread.is_alive() for thread in worker_threads),
+        'warm_drivers': len(driver_manager.idle),
+        'chrome_launches': driver_manager.launches,
+        'chrome_recycles': list(driver_manager.recycles),
+        'route_scheduler': route_scheduler.snapshot(),
+        'screenshot_cache_hits': screenshot_cache.hits,
+        'screenshot_cache_misses': screenshot_cache.misses,
+    }
+
+def main():
+    """Run the job workers until interrupted (SIGINT or SIGTERM)"""
+    global worker_running
+    
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    if app.config['WORKER_METRICS_PORT']:
+        metrics.serve(app.config['WORKER_METRICS_PORT'])
+        print(f"📈 Metrics on port {app.config['WORKER_METRICS_PORT']}")
+    
+    start_worker()
+    print(f"🚗 Capture worker ready ({app.config['CAPTURE_BACKEND']} capture), press Ctrl+C to stop")
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    
+    print("🛑 Stopping capture worker, jobs in progress are resumed by the next worker")
+    worker_running = False
+
+if __name__ == '__main__':
+    main()